@@ -1,19 +1,25 @@
 import sys
+import json
+import base64
+import fastjson
+import asyncio
 import uvicorn
 import sql
 
 from pathlib import Path
 from config import Config
-from database import DB
+from async_database import AsyncDB
+from cache import ResponseCache, ALL
 from loguru import logger
+from decimal import Decimal
 from fastapi import FastAPI
 from datetime import timedelta
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from timeit import default_timer as timer
 from tgbot import TelegramBot
 
-# TODO: Make all functions async with 'async def'
 # TODO: Search contract code contains
 # TODO: Total burned amount for token
 # TODO: API for total stamps used for address
@@ -24,28 +30,45 @@ from tgbot import TelegramBot
 # TODO: API to subscribe to state changes
 # TODO: API for which contract holds which funds
 # TODO: https://stackoverflow.com/questions/1237725/copying-postgresql-database-to-another-server
-# TODO: https://github.com/ultrajson/ultrajson
 # TODO: Total rewards for address
 # TODO: Use Starlite instead of FastAPI? https://github.com/starlite-api/starlite
 # TODO: Return everything for a contract - state, code, general data, ...
 
-app = FastAPI(title='LAPI')
+# Rows per chunk of a streamed response
+STREAM_CHUNK = 1000
+
+
+class FastJSONResponse(JSONResponse):
+    """ JSON response rendered by the fastest available library - JSON from the DB is inserted as it is """
+
+    def render(self, content) -> bytes:
+        return fastjson.dumps_bytes(content)
+
+
+app = FastAPI(title='LAPI', default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browsers only let scripts read listed headers - needed to get the next page
+    expose_headers=["X-Next-Cursor"],
     allow_credentials=True
 )
 
 cfg = Config('cfg', 'api.json')
+sync_cfg = Config('cfg', 'sync.json')
 
 tg_cfg = Config('cfg', 'tgbot.json')
 bot = TelegramBot(tg_cfg)
 
 db_cfg = Config('cfg', 'db.json')
-db = DB(db_cfg)
+db = AsyncDB(db_cfg)
+
+# Responses that only change with new blocks
+cache = ResponseCache(size=cfg.get('cache_size') or 1000, ttl=cfg.get('cache_ttl') or 60)
+listener = None
 
 logger.remove()
 
@@ -62,6 +85,91 @@ logger.add(
     diagnose=True)
 
 
+@app.on_event('startup')
+async def startup():
+    global listener
+
+    await db.open()
+
+    # Sync notifies about changed data after every block
+    if sync_cfg.get('notify_channel'):
+        listener = asyncio.create_task(db.listen(
+            sync_cfg.get('notify_channel'),
+            lambda payload: cache.invalidate(json.loads(payload)),
+            on_lost=lambda: cache.invalidate([ALL])))
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    if listener: listener.cancel()
+    await db.close()
+
+
+async def cached(tags: tuple, query: str, params: dict) -> list:
+    """ Execute query or return the cached result - invalidated if data with one of the tags changes """
+
+    key = (query, tuple(params.items()))
+    found, result = cache.get(key)
+
+    if found:
+        return result
+
+    generation = cache.generation
+    result = await db.execute(query, params)
+    cache.put(key, result, tags, generation=generation)
+
+    return result
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str, *types) -> list:
+    """ Values of the cursor converted with 'types' - ValueError if they don't fit """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+
+        # Only numbers and strings are put into cursors
+        if not all(isinstance(v, (int, str)) and not isinstance(v, bool) for v in values):
+            raise ValueError
+
+        return [convert(value) for convert, value in zip(types, values)]
+    except Exception:
+        raise ValueError(f'Invalid cursor: {token}')
+
+
+def streamed(rows) -> StreamingResponse:
+    """ Response that sends rows while they are fetched - one JSON row per line """
+
+    async def chunks():
+        count, buffer = 0, list()
+
+        try:
+            async for row in rows:
+                buffer.append(fastjson.dumps(row) + '\n')
+                count += 1
+
+                if len(buffer) >= STREAM_CHUNK:
+                    yield ''.join(buffer)
+                    buffer.clear()
+
+            yield ''.join(buffer)
+
+        except Exception as e:
+            # Headers are sent already - the response just ends
+            logger.exception(f'Error while streaming response: {e}')
+
+        finally:
+            await rows.aclose()
+            logger.debug(f'API <-- streamed {count} rows')
+
+    return StreamingResponse(chunks(), media_type='application/x-ndjson')
+
+
 @app.get('/favicon.ico', include_in_schema=False)
 async def favicon():
     return FileResponse(Path('res', 'favicon.ico'))
@@ -74,49 +182,75 @@ def root():
 
 
 @app.get("/db-size")
-def db_size():
+async def db_size():
     start = timer()
 
     try:
 
         logger.debug(f'API --> db_size()')
-        result = db.execute(sql.select_db_size(), {'n': db_cfg.get('db_name')})
+        result = await cached(('blocks',), sql.select_db_size(), {'n': db_cfg.get('db_name')})
         logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-        return result[0][0]
+        return FastJSONResponse(result[0][0])
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
 @app.get("/holders/{contract}")
-def get_holders(contract: str, addresses: bool = True, contracts: bool = True, limit: int = 0):
+async def get_holders(contract: str, addresses: bool = True, contracts: bool = True,
+                      limit: int = 0, cursor: str = None, stream: bool = False):
     start = timer()
 
     try:
 
-        logger.debug(f'API --> get_holders({contract}, {addresses}, {contracts}, {limit})')
-        result = db.execute(sql.select_holders(contract, addresses, contracts, limit))
+        logger.debug(f'API --> get_holders({contract}, {addresses}, {contracts}, {limit}, {cursor}, {stream})')
+
+        query = sql.select_holders(after=bool(cursor))
+        params = {'c': contract, 'a': addresses, 'cs': contracts, 'l': limit or None}
+
+        if cursor:
+            amount, address = decode_cursor(cursor, Decimal, str)
+            params.update({'aa': amount, 'ad': address})
+
+        # Holders are sent while they are read instead of being loaded at once
+        if stream:
+            return streamed(db.stream(query, params))
+
+        result = await cached((f'balances:{contract}',), query, params)
         logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-        return result
+        headers = dict()
+        if limit and len(result) == limit:
+            headers['X-Next-Cursor'] = encode_cursor([str(result[-1][1]), result[-1][0]])
+
+        return FastJSONResponse(result, headers=headers)
+
+    except ValueError as e:
+        return {'error': repr(e)}
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
 @app.get("/balance/{address}")
-def get_balance(address: str, contract: str = None):
+async def get_balance(address: str, contract: str = None, at_block: int = None):
     start = timer()
 
     try:
 
-        logger.debug(f'API --> get_balance({address}, {contract})')
+        logger.debug(f'API --> get_balance({address}, {contract}, {at_block})')
 
         if contract:
-            result = db.execute(sql.select_balance(address, contract))
+            # Balance after block 'at_block' from the state history
+            if at_block is not None:
+                query, params = sql.select_balance_at(), {'k': f'{contract}.balances:{address}', 'b': at_block}
+            else:
+                query, params = sql.select_balance(), {'c': contract, 'a': address}
+
+            result = await cached((f'address:{address}',), query, params)
             logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
             if result and result[0] and result[0][0]:
@@ -125,115 +259,210 @@ def get_balance(address: str, contract: str = None):
                 return 0
 
         else:
-            result = db.execute(sql.select_balances(address))
+            if at_block is not None:
+                query, params = sql.select_balances_at(), {'a': address, 'b': at_block}
+            else:
+                query, params = sql.select_balances(), {'a': address}
+
+            result = await cached((f'address:{address}',), query, params)
             logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-            return result
+            return FastJSONResponse(result)
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
+        return {'error': repr(e)}
+
+
+@app.get("/transactions/{address}")
+async def get_transactions(address: str, limit: int = 0, cursor: str = None, stream: bool = False):
+    start = timer()
+
+    try:
+
+        logger.debug(f'API --> get_transactions({address}, {limit}, {cursor}, {stream})')
+
+        query = sql.select_address_transactions(after=bool(cursor))
+        params = {'a': address, 'l': limit or None}
+
+        if cursor:
+            block_num, tx_hash, role = decode_cursor(cursor, int, str, str)
+            params.update({'ab': block_num, 'ah': tx_hash, 'ar': role})
+
+        if stream:
+            return streamed(db.stream(query, params))
+
+        result = await cached((f'address:{address}',), query, params)
+        logger.debug(f'API <-- after {timer() - start:.3f} seconds')
+
+        headers = dict()
+        if limit and len(result) == limit:
+            last = fastjson.loads(result[-1][0])
+            headers['X-Next-Cursor'] = encode_cursor([last['block_num'], last['hash'], last['role']])
+
+        return FastJSONResponse(result, headers=headers)
+
+    except ValueError as e:
+        return {'error': repr(e)}
+
+    except Exception as e:
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
 @app.get("/raw_state/{key}")
-def get_raw_state(key: str = None):
+async def get_raw_state(key: str = None):
     start = timer()
 
     try:
 
         logger.debug(f'API --> get_raw_state({key})')
-        result = db.execute(sql.select_raw_state(), {'k': key})
+        result = await db.execute(sql.select_raw_state(), {'k': key})
         logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-        return result[0][0]
+        return FastJSONResponse(result[0][0])
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
 @app.get("/raw_states/{key}")
-def get_raw_states(key: str = None):
+async def get_raw_states(key: str = None, limit: int = 0, cursor: str = None, stream: bool = False):
     start = timer()
 
     try:
 
-        logger.debug(f'API --> get_raw_states({key})')
-        result = db.execute(sql.select_raw_states(key))
+        logger.debug(f'API --> get_raw_states({key}, {limit}, {cursor}, {stream})')
+
+        query = sql.select_raw_states(after=bool(cursor))
+        params = {'k': key, 'l': limit or None}
+
+        if cursor:
+            params['after'] = decode_cursor(cursor, str)[0]
+
+        if stream:
+            return streamed(db.stream(query, params))
+
+        result = await db.execute(query, params)
         logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-        return result
+        headers = dict()
+        if limit and len(result) == limit:
+            headers['X-Next-Cursor'] = encode_cursor([fastjson.loads(result[-1][0])['key']])
+
+        return FastJSONResponse(result, headers=headers)
+
+    except ValueError as e:
+        return {'error': repr(e)}
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
 @app.get("/state/{key}")
-def get_state(key: str = None):
+async def get_state(key: str = None, at_block: int = None):
     start = timer()
 
     try:
 
-        logger.debug(f'API --> get_state({key})')
-        result = db.execute(sql.select_state(clean=True), {'k': key})
+        logger.debug(f'API --> get_state({key}, {at_block})')
+
+        # Value after block 'at_block' from the state history
+        if at_block is not None:
+            result = await db.execute(sql.select_state_at(clean=True), {'k': key, 'b': at_block})
+        else:
+            result = await db.execute(sql.select_state(clean=True), {'k': key})
+
         logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-        return result[0][0]
+        return FastJSONResponse(result[0][0])
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
 @app.get("/states/{key}")
-def get_states(key: str = None):
+async def get_states(key: str = None, limit: int = 0, cursor: str = None, stream: bool = False):
     start = timer()
 
     try:
 
-        logger.debug(f'API --> get_states({key})')
-        result = db.execute(sql.select_states(key, clean=True))
+        logger.debug(f'API --> get_states({key}, {limit}, {cursor}, {stream})')
+
+        query = sql.select_states(clean=True, after=bool(cursor))
+        params = {'k': key, 'l': limit or None}
+
+        if cursor:
+            params['after'] = decode_cursor(cursor, str)[0]
+
+        if stream:
+            return streamed(db.stream(query, params))
+
+        result = await db.execute(query, params)
         logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-        return result
+        headers = dict()
+        if limit and len(result) == limit:
+            headers['X-Next-Cursor'] = encode_cursor([result[-1][0]])
+
+        return FastJSONResponse(result, headers=headers)
+
+    except ValueError as e:
+        return {'error': repr(e)}
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
 @app.get("/contract/{contract}")
-def get_contract(contract: str):
+async def get_contract(contract: str):
     start = timer()
 
     try:
 
         logger.debug(f'API --> get_contract({contract})')
-        result = db.execute(sql.select_contract(), {'c': contract})
+        result = await cached((f'contract:{contract}',), sql.select_contract(), {'c': contract})
         logger.debug(f'API <-- after {timer() - start:.3f} seconds')
 
-        return result[0][0]
+        return FastJSONResponse(result[0][0])
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
-# TODO: Make sure it works
+@app.get("/metrics")
+def get_metrics():
+    try:
+
+        # Written periodically by the sync process
+        with open(sync_cfg.get('metrics_file'), encoding='utf-8') as f:
+            metrics = json.load(f)
+
+    except Exception as e:
+        metrics = {'error': repr(e)}
+
+    metrics['api_cache'] = cache.stats()
+    return metrics
+
+
 @app.get("/contracts")
-def get_contracts(name: str = None, lst001: bool = False, lst002: bool = False, lst003: bool = False):
+async def get_contracts(name: str = None, lst001: bool = False, lst002: bool = False, lst003: bool = False):
     start = timer()
 
     try:
 
         logger.debug(f'API --> get_contracts({name}, {lst001}, {lst002}, {lst003})')
-        result = db.execute(sql.select_contracts(), {'n': name})
+        result = await cached(('contracts',), sql.select_contracts(), {'n': name, 'l1': lst001, 'l2': lst002, 'l3': lst003})
         logger.debug(f'API <-- after: {timer() - start:.3f} seconds')
-        return result
+        return FastJSONResponse(result)
 
     except Exception as e:
-        bot.send(repr(e))
+        await run_in_threadpool(bot.send, repr(e))
         return {'error': repr(e)}
 
 
@@ -0,0 +1,234 @@
+import os
+import struct
+import hashlib
+import fastjson
+import zstandard
+
+from pathlib import Path
+from loguru import logger
+from threading import Lock, local
+
+# Index record - block number, segment, offset and length of the compressed block, digest of the block hash
+RECORD = struct.Struct('<QIQI16s')
+
+# Segment files are rolled over at this size in bytes
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+# zstd compression level
+LEVEL = 3
+
+INDEX_FILE = 'index'
+
+
+def _digest(block_hash: str) -> bytes:
+    return hashlib.blake2b(block_hash.encode('utf-8'), digest_size=16).digest()
+
+
+class BlockArchive:
+    """ Blocks in append-only segment files - one zstd frame per block and an index to find them by number or hash.
+    Only one process can append to an archive, but any number can read from it """
+
+    def __init__(self, path: str, segment_size: int = None, level: int = None):
+        self.path = Path(path)
+
+        self._segment_size = segment_size or SEGMENT_SIZE
+        self._compressor = zstandard.ZstdCompressor(level=level or LEVEL)
+        self._local = local()
+        self._lock = Lock()
+
+        # Block number -> (segment, offset, length, hash digest)
+        self._numbers = dict()
+        # Hash digest -> block number
+        self._hashes = dict()
+        # Segment -> file descriptor for reading
+        self._readers = dict()
+
+        # Bytes of the index that are loaded
+        self._index_size = 0
+        # Segment that is appended to and end of its last indexed block
+        self._segment = 0
+        self._segment_end = 0
+
+        self._index_file = None
+        self._segment_file = None
+
+        self._load()
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def __contains__(self, block_id):
+        return self._find(block_id) is not None
+
+    @property
+    def numbers(self) -> list:
+        return sorted(self._numbers)
+
+    def _segment_path(self, segment: int) -> Path:
+        return Path(self.path, f'{segment:06d}.zst')
+
+    def _load(self):
+        # Records that got appended since the last call
+        index = Path(self.path, INDEX_FILE)
+
+        if not index.is_file():
+            return
+
+        with open(index, 'rb') as f:
+            f.seek(self._index_size)
+            data = f.read()
+
+        # Incomplete record of an interrupted append is ignored
+        data = data[:len(data) - len(data) % RECORD.size]
+
+        # Later records win - a block that got archived again replaces the old one
+        for number, segment, offset, length, digest in RECORD.iter_unpack(data):
+            self._index(number, (segment, offset, length, digest))
+
+            if (segment, offset + length) > (self._segment, self._segment_end):
+                self._segment, self._segment_end = segment, offset + length
+
+        self._index_size += len(data)
+
+    def _open(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # Cut off everything an interrupted append wrote past the last indexed block
+        self._index_file = open(Path(self.path, INDEX_FILE), 'ab')
+        self._index_file.truncate(self._index_size)
+
+        self._segment_file = open(self._segment_path(self._segment), 'ab')
+        self._segment_file.truncate(self._segment_end)
+
+    def _roll(self):
+        self._segment_file.close()
+
+        self._segment += 1
+        self._segment_end = 0
+        # Anything in it was written by an interrupted append after a roll-over
+        self._segment_file = open(self._segment_path(self._segment), 'wb')
+
+        logger.debug(f'Archive {self.path} - started segment {self._segment}')
+
+    def _index(self, number: int, location: tuple):
+        replaced = self._numbers.get(number)
+
+        # Hash of a replaced block does not lead to this number anymore
+        if replaced and self._hashes.get(replaced[3]) == number:
+            del self._hashes[replaced[3]]
+
+        self._numbers[number] = location
+        self._hashes[location[3]] = number
+
+    def _find(self, block_id: (int, str)) -> int:
+        if isinstance(block_id, int):
+            return block_id if block_id in self._numbers else None
+
+        number = self._hashes.get(_digest(block_id))
+
+        if number is None and block_id.isdigit() and int(block_id) in self._numbers:
+            number = int(block_id)
+
+        return number
+
+    def _reader(self, segment: int) -> int:
+        fd = self._readers.get(segment)
+
+        if fd is None:
+            with self._lock:
+                if segment not in self._readers:
+                    self._readers[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+                fd = self._readers[segment]
+
+        return fd
+
+    def append(self, blocks: list) -> int:
+        """ Add blocks that are not archived yet and return how many got added """
+
+        with self._lock:
+            if not self._index_file:
+                self._open()
+
+            records, entries = list(), list()
+
+            for block in blocks:
+                digest = _digest(block.hash)
+
+                if self._numbers.get(block.number, (None,) * 4)[3] == digest:
+                    continue
+
+                frame = self._compressor.compress(fastjson.dumps_bytes(block.content))
+
+                if self._segment_end and self._segment_end + len(frame) > self._segment_size:
+                    self._segment_file.flush()
+                    self._roll()
+
+                self._segment_file.write(frame)
+
+                records.append(RECORD.pack(block.number, self._segment, self._segment_end, len(frame), digest))
+                entries.append((block.number, (self._segment, self._segment_end, len(frame), digest)))
+
+                self._segment_end += len(frame)
+
+            if not records:
+                return 0
+
+            # Blocks are written before the index points to them
+            self._segment_file.flush()
+            self._index_file.write(b''.join(records))
+            self._index_file.flush()
+
+            self._index_size += len(records) * RECORD.size
+
+            for number, location in entries:
+                self._index(number, location)
+
+            return len(records)
+
+    def get(self, block_id: (int, str)) -> dict:
+        """ Content of the block with the number or hash - None if it is not archived """
+
+        number = self._find(block_id)
+
+        if number is None:
+            # Might have been appended by another process meanwhile
+            with self._lock:
+                self._load()
+
+            number = self._find(block_id)
+
+            if number is None:
+                return None
+
+        segment, offset, length, _ = self._numbers[number]
+        frame = os.pread(self._reader(segment), length, offset)
+
+        if not hasattr(self._local, 'decompressor'):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+
+        try:
+            return fastjson.loads(self._local.decompressor.decompress(frame))
+        except zstandard.ZstdError as e:
+            raise ValueError(f'Block {number} in archive {self.path} is corrupt: {e}')
+
+    def iter(self, start: int = None, end: int = None):
+        """ Blocks ordered by number - from 'start' to 'end' including both """
+
+        for number in self.numbers:
+            if start is not None and number < start:
+                continue
+            if end is not None and number > end:
+                break
+
+            yield self.get(number)
+
+    def close(self):
+        with self._lock:
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers.clear()
+
+            if self._index_file:
+                self._segment_file.close()
+                self._index_file.close()
+                self._index_file, self._segment_file = None, None
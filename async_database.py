@@ -0,0 +1,131 @@
+import asyncio
+import fastjson
+import asyncpg
+
+from loguru import logger
+from config import Config
+from database import positional
+from asyncpg.exceptions import InterfaceError, PostgresConnectionError
+
+# Seconds to wait before listening again after the connection got lost
+LISTEN_RETRY = 5
+
+
+class AsyncDB:
+    """ Non-blocking access to the DB for the API - uses the same statements as DB """
+
+    cfg = None
+
+    _pool = None
+
+    def __init__(self, config: Config):
+        self.cfg = config
+
+    async def _init_connection(self, con):
+        # JSON is returned as it is and inserted into responses without decoding and encoding it again
+        for name in ('json', 'jsonb'):
+            await con.set_type_codec(name, encoder=fastjson.dumps, decoder=fastjson.RawJSON, schema='pg_catalog')
+
+    def _connect_args(self) -> dict:
+        return dict(
+            database=self.cfg.get('db_name'),
+            user=self.cfg.get('db_user'),
+            password=self.cfg.get('db_pass'),
+            host=self.cfg.get('db_host'),
+            port=self.cfg.get('db_port'))
+
+    async def open(self):
+        """ Create the connection pool - needs to be called before executing statements """
+
+        if self._pool:
+            return
+
+        pool_min = self.cfg.get('db_pool_min') or 1
+        pool_max = self.cfg.get('db_pool_max') or 10
+
+        logger.debug(f'Creating async DB connection pool ({pool_min} - {pool_max} connections)')
+
+        self._pool = await asyncpg.create_pool(
+            **self._connect_args(),
+            min_size=min(pool_min, pool_max),
+            max_size=pool_max,
+            # Seconds a connection can be idle before it gets closed
+            max_inactive_connection_lifetime=self.cfg.get('db_pool_check') or 300,
+            init=self._init_connection)
+
+    async def close(self):
+        if self._pool:
+            await self._pool.close()
+            self._pool = None
+
+    async def listen(self, channel: str, callback, on_lost=None):
+        """ Call 'callback' with the payload of every notification on the channel until cancelled """
+
+        while True:
+            con = None
+
+            try:
+                # Dedicated connection - pooled ones are reset when released
+                con = await asyncpg.connect(**self._connect_args())
+
+                lost = asyncio.Event()
+                con.add_termination_listener(lambda c: lost.set())
+                await con.add_listener(channel, lambda c, pid, ch, payload: callback(payload))
+
+                logger.debug(f'Listening for notifications on channel {channel}')
+                await lost.wait()
+
+            except (OSError, PostgresConnectionError, InterfaceError) as e:
+                logger.warning(f'Could not listen on channel {channel}: {e}')
+
+            except Exception as e:
+                # Listening again is the only way to keep the cache invalidated - cancellation still ends it
+                logger.exception(f'Error while listening on channel {channel}: {e}')
+
+            finally:
+                # Only left open after errors - closing it could fail the same way
+                if con and not con.is_closed():
+                    con.terminate()
+
+            # Notifications might have been missed meanwhile
+            logger.warning(f'Lost connection for notifications on channel {channel}')
+            if on_lost: on_lost()
+
+            await asyncio.sleep(LISTEN_RETRY)
+
+    async def stream(self, query: str, params: dict = None, size: int = 1000):
+        """ Rows of the query fetched in chunks by a server-side cursor instead of all at once """
+
+        statement, names = positional(query)
+        args = [params[name] for name in names]
+
+        # Connection is occupied until all rows are consumed or the generator is closed
+        async with self._pool.acquire() as con:
+            async with con.transaction():
+                async for row in con.cursor(statement, *args, prefetch=size):
+                    yield tuple(row)
+
+    async def execute(self, query: str, params: dict = None, retry: bool = True) -> list:
+        # Statements are prepared and cached per connection by asyncpg
+        statement, names = positional(query)
+        args = [params[name] for name in names]
+
+        try:
+            async with self._pool.acquire() as con:
+                rows = await con.fetch(statement, *args)
+
+            # Rows as tuples - same as DB.execute()
+            return [tuple(row) for row in rows]
+
+        except (PostgresConnectionError, InterfaceError, ConnectionError) as e:
+            # Connection got lost - try once more with a new one
+            if retry:
+                logger.warning(f'DB connection failed, reconnecting: {e}')
+                return await self.execute(query, params, retry=False)
+
+            logger.exception(f'Error while executing SQL: {e}')
+            raise e
+
+        except Exception as e:
+            logger.exception(f'Error while executing SQL: {e}')
+            raise e
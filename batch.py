@@ -0,0 +1,137 @@
+import fastjson
+
+from block import Block
+
+
+class Batch:
+    """ Collects all rows of one or more blocks so that they can be written in one transaction """
+
+    def __init__(self, blocks: list = None):
+        self._blocks = dict()
+        self._transactions = dict()
+        self._rewards = dict()
+        self._state = dict()
+        self._history = dict()
+        self._addresses = dict()
+        self._address_txs = dict()
+        self._contracts = dict()
+
+        for block in blocks or list():
+            self.add(block)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @property
+    def numbers(self) -> list:
+        return sorted(self._blocks)
+
+    @property
+    def blocks(self) -> list:
+        return [self._blocks[k] for k in sorted(self._blocks)]
+
+    @property
+    def transactions(self) -> list:
+        return [self._transactions[k] for k in sorted(self._transactions)]
+
+    @property
+    def rewards(self) -> list:
+        return [self._rewards[k] for k in sorted(self._rewards)]
+
+    @property
+    def state(self) -> list:
+        # Sorted by key so that concurrent writers lock rows in the same order
+        return [self._state[k] for k in sorted(self._state)]
+
+    @property
+    def history(self) -> list:
+        return [self._history[k] for k in sorted(self._history)]
+
+    @property
+    def addresses(self) -> list:
+        return [self._addresses[k] for k in sorted(self._addresses)]
+
+    @property
+    def address_txs(self) -> list:
+        return [self._address_txs[k] for k in sorted(self._address_txs)]
+
+    @property
+    def contracts(self) -> list:
+        return [self._contracts[k] for k in sorted(self._contracts)]
+
+    def add(self, block: Block):
+        self.add_block(block)
+        self.add_tx(block)
+        self.add_address_txs(block)
+        self.add_rewards(block)
+
+        # Rewards state
+        for kv in block.rewards:
+            self.add_state(block, kv['key'], kv['value'])
+
+        # TAU balance of sender (tx fee reduction)
+        for kv in block.state:
+            if kv['key'] == f'currency.balances:{block.sender}':
+                self.add_state(block, kv['key'], kv['value'])
+
+        if block.tx_is_valid:
+            for kv in block.state:
+                self.add_state(block, kv['key'], kv['value'])
+
+            for address in block.addresses:
+                self.add_address(block, address)
+
+            if block.is_new_contract:
+                self.add_contract(block)
+
+    def add_block(self, block: Block):
+        self._blocks[block.number] = (block.number, block.hash, fastjson.dumps(block.content), block.timestamp, block.prev)
+
+    def add_tx(self, block: Block):
+        if block.tx_hash:
+            self._transactions[block.tx_hash] = (block.number, block.tx_hash, fastjson.dumps(block.tx), block.timestamp)
+
+    def add_address_txs(self, block: Block):
+        if not block.tx_hash:
+            return
+
+        for address in block.addresses:
+            role = 'sender' if address == block.sender else 'recipient'
+
+            # Sender pays for invalid transactions too - recipients only take part in valid ones
+            if role == 'recipient' and not block.tx_is_valid:
+                continue
+
+            self._address_txs[(address, block.tx_hash, role)] = \
+                (address, block.number, block.tx_hash, role, block.tx_contract, block.tx_function)
+
+    def add_rewards(self, block: Block):
+        for rw in block.rewards:
+            self._rewards[(block.number, rw['key'])] = \
+                (block.number, rw['key'], fastjson.dumps(rw['value']), fastjson.dumps(rw['reward']), block.timestamp)
+
+    def add_state(self, block: Block, key: str, value):
+        value = fastjson.dumps(value)
+
+        # Every change is kept in the history
+        self._history[(key, block.number)] = (key, block.number, value)
+
+        # Newest block wins
+        if key in self._state and self._state[key][0] > block.number:
+            return
+
+        self._state[key] = (block.number, key, value, block.timestamp, block.timestamp)
+
+    def add_address(self, block: Block, address: str):
+        # Oldest block wins
+        if address in self._addresses and self._addresses[address][0] < block.number:
+            return
+
+        self._addresses[address] = (block.number, address, block.timestamp)
+
+    def add_contract(self, block: Block):
+        if block.contract in self._contracts and self._contracts[block.contract][0] > block.number:
+            return
+
+        self._contracts[block.contract] = (block.number, block.contract, block.code,
+            block.is_lst001, block.is_lst002, block.is_lst003, block.timestamp)
@@ -0,0 +1,498 @@
+import sys
+import sql
+import json
+import time
+import random
+import hashlib
+import fastjson
+import importlib
+import typer
+import tracemalloc
+
+from requests import Session
+from loguru import logger
+from block import Block
+from batch import Batch
+from archive import BlockArchive
+from sync import Sync
+from config import Config
+from database import DB
+from statistics import quantiles
+from datetime import datetime, timezone
+from fastapi.encoders import jsonable_encoder
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import local
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+from psycopg2.extras import execute_values
+
+# Benchmarks run against the DB configured in cfg/db.json and
+# use the blocks in the archive 'archive_dir' of cfg/sync.json as corpus.
+# The ones that write rows need '--database' - a separate DB on the same server with the same tables
+# and at least one block, e.g. a copy made with 'createdb -T'.
+
+db_cfg = Config('cfg', 'db.json')
+sync_cfg = Config('cfg', 'sync.json')
+sync_cfg.set('archive_blocks', False, dump=False)
+app = typer.Typer()
+
+logger.remove()
+logger.add(sys.stderr, level='WARNING')
+
+
+def load_blocks(count: int) -> list:
+    archive = BlockArchive(sync_cfg.get('archive_dir'))
+    numbers = archive.numbers
+    if count: numbers = numbers[-count:]
+
+    blocks = [archive.get(number) for number in numbers]
+    archive.close()
+
+    logger.warning(f'Loaded {len(blocks)} blocks from {archive.path}')
+    return blocks
+
+
+def bench_db_cfg(database: str) -> Config:
+    """ Configuration of the DB that benchmarks write to - never the one in cfg/db.json """
+
+    if database == db_cfg.get('db_name'):
+        raise typer.BadParameter(f'{database} is the DB of the service - use a separate DB for benchmarks')
+
+    cfg = Config('cfg', 'db.json')
+    cfg.set('db_name', database, dump=False)
+    return cfg
+
+
+def percentiles(samples: list) -> str:
+    cuts = quantiles(samples, n=100)
+    return f'p50 {cuts[49] * 1000:.2f} ms, p99 {cuts[98] * 1000:.2f} ms'
+
+
+def api_queries(blocks: list, database: str) -> list:
+    # The statements behind the hot API endpoints
+    queries = [('SELECT pg_size_pretty(pg_database_size(%(n)s))', {'n': database})]
+
+    for content in blocks:
+        block = Block(content)
+        for kv in block.state:
+            queries.append(('SELECT value FROM state WHERE key = %(k)s', {'k': kv['key']}))
+        for address in block.addresses:
+            queries.append(('SELECT * FROM addresses WHERE address = %(a)s', {'a': address}))
+
+    return queries
+
+
+@app.command()
+def pool(database: str = typer.Option(..., help='DB the blocks are saved in'),
+         blocks: int = 500, requests: int = 2000, threads: int = 8):
+    """ Blocks/sec and API query latency with and without connection pooling """
+
+    cfg = bench_db_cfg(database)
+    corpus = load_blocks(blocks)
+    queries = api_queries(corpus, database)
+
+    for pooled in (False, True):
+        db = DB(cfg, pooled=pooled)
+        sync = Sync(sync_cfg, db, None)
+        label = 'pooled' if pooled else 'unpooled'
+
+        start = timer()
+        for content in corpus:
+            sync.process_block(Block(content))
+        elapsed = timer() - start
+
+        print(f'{label:>10}: {len(corpus) / elapsed:.1f} blocks/sec')
+
+        def query(i):
+            q, params = queries[i % len(queries)]
+            start_time = timer()
+            db.execute(q, params)
+            return timer() - start_time
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(query, range(requests)))
+
+        print(f'{label:>10}: API queries {percentiles(latencies)}')
+        db.close()
+
+
+@app.command()
+def block(blocks: int = 0, rounds: int = 5):
+    """ Block construction throughput and memory per block """
+
+    corpus = load_blocks(blocks)
+
+    def derive(b: Block):
+        # Everything sync reads from a block
+        return b.tx, b.state, b.rewards, b.sender, b.addresses, b.is_lst001, b.is_lst002, b.is_lst003
+
+    for label, access in (('construct', False), ('construct + derive', True)):
+        start = timer()
+        for _ in range(rounds):
+            for content in corpus:
+                b = Block(content)
+                if access: derive(b)
+        elapsed = timer() - start
+
+        print(f'{label:>20}: {len(corpus) * rounds / elapsed:.0f} blocks/sec')
+
+    # Memory held by the Block objects themselves - content is shared
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [Block(content) for content in corpus]
+    for b in kept: derive(b)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f'{"memory":>20}: {(after - before) / max(len(kept), 1):.0f} bytes/block')
+
+
+@app.command(name='json')
+def json_(blocks: int = 0, rounds: int = 5, states: int = 10000):
+    """ JSON encoding and decoding of blocks and API responses per library """
+
+    corpus = load_blocks(blocks)
+    texts = [json.dumps(content) for content in corpus]
+
+    libraries = {'json': (lambda o: json.dumps(o, ensure_ascii=False, separators=(',', ':')), json.loads)}
+    for name in ('ujson', 'orjson'):
+        try:
+            module = importlib.import_module(name)
+            libraries[name] = (module.dumps, module.loads)
+        except ImportError:
+            print(f'{name:>10}: not installed')
+
+    def rate(function, items) -> float:
+        start = timer()
+        for _ in range(rounds):
+            for item in items:
+                function(item)
+        return len(items) * rounds / (timer() - start)
+
+    for name, (dumps, loads) in libraries.items():
+        print(f'{name:>10}: dumps {rate(dumps, corpus):.0f} blocks/sec, loads {rate(loads, texts):.0f} blocks/sec')
+
+    # Rows of all tables for the blocks as sync builds them
+    start = timer()
+    for _ in range(rounds):
+        Batch([Block(content) for content in corpus])
+    print(f'{"batch":>10}: {len(corpus) * rounds / (timer() - start):.0f} blocks/sec with {fastjson.BACKEND}')
+
+    # Response of /raw_states - decoded, converted and encoded again or inserted as it is
+    db = DB(db_cfg)
+    rows = [json.dumps(r[0]) for r in db.execute(sql.select_raw_states(), {'k': '', 'l': states})]
+    db.close()
+
+    def decoded(raw: list) -> bytes:
+        content = jsonable_encoder([(json.loads(r),) for r in raw])
+        return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def passthrough(raw: list) -> bytes:
+        return fastjson.dumps_bytes([(fastjson.RawJSON(r),) for r in raw])
+
+    for label, render in (('decoded', decoded), ('raw', passthrough)):
+        print(f'{label:>10}: /raw_states with {len(rows)} rows {rate(render, [rows]):.1f} responses/sec')
+
+
+@app.command()
+def state(database: str = typer.Option(..., help='DB the synthetic balances are saved in'),
+          rows: int = 1000000, contracts: int = 100, requests: int = 200, clean: bool = True):
+    """ Latency of the /balance and /holders queries with synthetic balances """
+
+    db = DB(bench_db_cfg(database))
+    addresses = max(rows // contracts, 1)
+
+    def address(i):
+        return hashlib.md5(str(i).encode()).hexdigest() * 2
+
+    # Keys look like 'con_bench_7.balances:{64 hex chars}'
+    start = timer()
+    db.execute("""
+    INSERT INTO state(block_num, key, value, updated, created)
+    SELECT (SELECT min(number) FROM blocks), 'con_bench_' || c || '.balances:' || md5(a::text) || md5(a::text),
+      jsonb_build_object('__fixed__', (random() * 1000)::numeric(20, 8)::text), now(), now()
+    FROM generate_series(1, %(c)s) c, generate_series(1, %(a)s) a
+    ON CONFLICT (key) DO NOTHING
+    """, {'c': contracts, 'a': addresses})
+    db.execute(sql.insert_all_balances())
+    db.execute('ANALYZE state')
+    db.execute('ANALYZE balances')
+    print(f'{"fill":>10}: {contracts * addresses} rows - {timer() - start:.1f} seconds')
+
+    try:
+        size = db.execute('SELECT count(*) FROM state')[0][0]
+        print(f'{"state":>10}: {size} rows')
+
+        def sample(i):
+            contract, addr = f'con_bench_{random.randint(1, contracts)}', address(random.randint(1, addresses))
+            return {
+                '/balance': (sql.select_balance(), {'c': contract, 'a': addr}),
+                '/balance (all)': (sql.select_balances(), {'a': addr}),
+                '/holders': (sql.select_holders(), {'c': contract, 'a': True, 'cs': True, 'l': 100})}
+
+        queries = [sample(i) for i in range(requests)]
+
+        for name in queries[0]:
+            plan = db.execute('EXPLAIN ' + queries[0][name][0], queries[0][name][1])
+            uses_index = any('Index' in line[0] for line in plan)
+
+            latencies = list()
+            for q in queries:
+                start_time = timer()
+                db.execute(*q[name])
+                latencies.append(timer() - start_time)
+
+            print(f'{name:>15}: {percentiles(latencies)} - {"index" if uses_index else "seq scan"}')
+
+    finally:
+        if clean:
+            db.execute(r"DELETE FROM balances WHERE contract LIKE 'con\_bench\_%'")
+            db.execute(r"DELETE FROM state WHERE key LIKE 'con\_bench\_%'")
+        db.close()
+
+
+@app.command()
+def prepared(requests: int = 1000):
+    """ Latency and planning time of hot API queries with and without prepared statements """
+
+    db = DB(db_cfg)
+
+    keys = [r[0] for r in db.execute('SELECT key FROM state TABLESAMPLE SYSTEM (10) LIMIT 100')]
+    holders = db.execute('SELECT contract, address FROM balances TABLESAMPLE SYSTEM (10) LIMIT 100')
+    numbers = [r[0] for r in db.execute('SELECT number FROM blocks LIMIT 100')]
+
+    if not (keys and holders and numbers):
+        print('Needs blocks, state and balances in the DB')
+        return
+
+    endpoints = {
+        '/state': lambda i: (sql.select_state(clean=True), {'k': keys[i % len(keys)]}),
+        '/states': lambda i: (sql.select_states(clean=True), {'k': keys[i % len(keys)][:-4]}),
+        '/balance': lambda i: (sql.select_balance(), {'c': holders[i % len(holders)][0], 'a': holders[i % len(holders)][1]}),
+        '/holders': lambda i: (sql.select_holders(), {'c': holders[i % len(holders)][0], 'a': True, 'cs': True, 'l': 100}),
+        'block': lambda i: (sql.select_block_by_num(), {'bn': numbers[i % len(numbers)]})}
+
+    def planning_time(prepare: bool, query: str, params: dict) -> float:
+        with db.connection() as con:
+            with con.cursor() as cur:
+                if prepare:
+                    name, names = con.prepare(query)
+                    args = ', '.join(f'%({n})s' for n in names)
+                    cur.execute(f'EXPLAIN (ANALYZE) EXECUTE {name}({args})', params)
+                else:
+                    cur.execute('EXPLAIN (ANALYZE) ' + query, params)
+
+                for (line,) in cur.fetchall():
+                    if line.startswith('Planning Time'):
+                        return float(line.split()[2])
+
+    for name, endpoint in endpoints.items():
+        for prepare in (False, True):
+            latencies = list()
+            for i in range(requests):
+                start_time = timer()
+                db.execute(*endpoint(i), prepare=prepare)
+                latencies.append(timer() - start_time)
+
+            planning = [planning_time(prepare, *endpoint(i)) for i in range(20)]
+            label = f'{name} {"prepared" if prepare else "plain"}'
+
+            print(f'{label:>20}: {percentiles(latencies)} - planning {sum(planning) / len(planning):.3f} ms')
+
+    db.close()
+
+
+@app.command()
+def partitions(database: str = typer.Option(..., help='DB the benchmark tables are created in'),
+               rows: int = 10000000, size: int = 2592000000000000, interval: float = 2, chunk: int = 500000,
+               batches: int = 50, requests: int = 200, clean: bool = True):
+    """ Insert rate and latency of recent block ranges in a plain and a partitioned blocks table """
+
+    db = DB(bench_db_cfg(database))
+
+    # Synthetic blocks every 'interval' seconds up to now - numbers are nanosecond timestamps like real ones
+    step = int(interval * 1e9)
+    first = time.time_ns() - rows * step
+    last = first + (rows - 1) * step
+
+    fill = """
+    INSERT INTO {t}(number, hash, block, created, previous)
+    SELECT %(f)s + n * %(st)s, md5(n::text) || md5((n + 1)::text),
+      jsonb_build_object(
+        'number', (%(f)s + n * %(st)s)::text,
+        'hash', md5(n::text) || md5((n + 1)::text),
+        'previous', md5((n - 1)::text) || md5(n::text),
+        'hlc_timestamp', to_timestamp((%(f)s + n * %(st)s) / 1e9)::text,
+        'processed', jsonb_build_object(
+          'hash', md5(n::text) || md5(n::text),
+          'transaction', jsonb_build_object(
+            'payload', jsonb_build_object('contract', 'currency', 'function', 'transfer',
+              'kwargs', jsonb_build_object('amount', n %% 1000, 'to', md5(n::text) || md5(n::text)))))),
+      to_timestamp((%(f)s + n * %(st)s) / 1e9), md5((n - 1)::text) || md5(n::text)
+    FROM generate_series(%(a)s::bigint, %(b)s::bigint - 1) n
+    """
+
+    def block_rows(start: int, count: int) -> list:
+        rows = list()
+        for n in range(start, start + count):
+            number = first + n * step
+            block_hash = hashlib.sha256(str(n).encode()).hexdigest()
+            previous = hashlib.sha256(str(n - 1).encode()).hexdigest()
+            content = {'number': str(number), 'hash': block_hash, 'previous': previous, 'processed': {'hash': block_hash}}
+            rows.append((number, block_hash, fastjson.dumps(content), datetime.fromtimestamp(number / 1e9, timezone.utc).replace(tzinfo=None), previous))
+        return rows
+
+    tables = {'plain': 'bench_blocks_plain', 'partitioned': 'bench_blocks_part'}
+
+    try:
+        for label, table in tables.items():
+            partitioned = label == 'partitioned'
+
+            db.execute(f'DROP TABLE IF EXISTS {table}')
+            db.execute(f"""
+            CREATE TABLE {table} (
+              number BIGINT NOT NULL PRIMARY KEY,
+              hash text NOT NULL,
+              block JSONB NOT NULL,
+              created TIMESTAMP NOT NULL,
+              previous text
+            ) {"PARTITION BY RANGE (number)" if partitioned else ""}
+            """)
+            db.execute(f'CREATE INDEX ON {table} (number) INCLUDE (hash, previous)')
+            db.execute(f'CREATE INDEX ON {table} (hash)')
+
+            if partitioned:
+                for index in range(first // size, (last + batches * 100 * step) // size + 1):
+                    db.execute(sql.create_partition(table, index, size))
+
+            # Bulk fill - rate of the last chunk shows how inserts slow down with the size of the table
+            start = timer()
+            for a in range(0, rows, chunk):
+                chunk_time = timer()
+                b = min(a + chunk, rows)
+                db.execute(fill.format(t=table), {'f': first, 'st': step, 'a': a, 'b': b})
+                rate = (b - a) / (timer() - chunk_time)
+
+            db.execute(f'ANALYZE {table}')
+            print(f'{label:>12}: filled {rows} rows - {rows / (timer() - start):.0f} rows/sec, last chunk {rate:.0f} rows/sec')
+
+            # Batches of new blocks like the sync writes them
+            insert = sql.insert_blocks().replace('INTO blocks', f'INTO {table}')
+            latencies = list()
+            for i in range(batches):
+                values = block_rows(rows + i * 100, 100)
+                start_time = timer()
+                with db.transaction() as cur:
+                    execute_values(cur, insert, values, page_size=100)
+                latencies.append(timer() - start_time)
+            print(f'{label:>12}: sync inserts {batches * 100 / sum(latencies):.0f} blocks/sec - {percentiles(latencies)} per 100 blocks')
+
+            newest = first + (rows - 1) * step
+            queries = {
+                'latest 100': (f'SELECT number, hash FROM {table} ORDER BY number DESC LIMIT 100', {}),
+                'last hour': (f'SELECT block FROM {table} WHERE number >= %(n)s', {'n': newest - 3600 * 10 ** 9}),
+                'last day count': (f'SELECT count(*) FROM {table} WHERE number >= %(n)s', {'n': newest - 86400 * 10 ** 9}),
+                'recent hash': (f'SELECT block FROM {table} WHERE hash = %(h)s', None)}
+
+            for name, (query, params) in queries.items():
+                latencies = list()
+                for i in range(requests):
+                    if params is None:
+                        n = rows - 1 - random.randint(0, 10000)
+                        params_i = {'h': hashlib.md5(str(n).encode()).hexdigest() + hashlib.md5(str(n + 1).encode()).hexdigest()}
+                    else:
+                        params_i = params
+                    start_time = timer()
+                    db.execute(query, params_i)
+                    latencies.append(timer() - start_time)
+                print(f'{label:>12}: {name:>15} - {percentiles(latencies)}')
+
+            # Maintenance only touches the partition that still changes
+            target = f'{table}_p{last // size}' if partitioned else table
+            start_time = timer()
+            db.execute(f'VACUUM (ANALYZE) {target}')
+            vacuum = timer() - start_time
+            total = db.execute('SELECT pg_size_pretty(pg_total_relation_size(%(t)s))', {'t': target})[0][0]
+            print(f'{label:>12}: vacuum {target} ({total}) - {vacuum:.3f} seconds')
+
+    finally:
+        if clean:
+            for table in tables.values():
+                db.execute(f'DROP TABLE IF EXISTS {table}')
+        db.close()
+
+
+@app.command()
+def load(url: str = 'http://127.0.0.1:8000', requests: int = 5000, concurrency: int = 32):
+    """ Requests/sec and latency of a running API under concurrent load """
+
+    db = DB(db_cfg)
+    holders = db.execute('SELECT contract, address FROM balances TABLESAMPLE SYSTEM (10) LIMIT 100')
+    keys = [r[0] for r in db.execute('SELECT key FROM state TABLESAMPLE SYSTEM (10) LIMIT 100')]
+    db.close()
+
+    # Mix of the hot endpoints
+    paths = [f'/state/{key}' for key in keys]
+    for contract, address in holders:
+        paths += [f'/balance/{address}?contract={contract}', f'/balance/{address}', f'/holders/{contract}?limit=100']
+
+    # One keep-alive connection per client thread
+    sessions = local()
+
+    def get(i):
+        if not hasattr(sessions, 'session'):
+            sessions.session = Session()
+
+        start_time = timer()
+        response = sessions.session.get(url + paths[i % len(paths)])
+        failed = response.status_code != 200 or 'error' in response.text[:20]
+        return timer() - start_time, failed
+
+    start = timer()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(get, range(requests)))
+    elapsed = timer() - start
+
+    latencies = [r[0] for r in results]
+    failed = sum(r[1] for r in results)
+
+    print(f'{requests / elapsed:.0f} requests/sec, {percentiles(latencies)}, {failed} failed')
+
+
+@app.command()
+def stub(port: int = 8001, delay: float = 0):
+    """ Local block service that delivers the corpus - use 'http://127.0.0.1:{port}/blocks/{block}' as host """
+
+    index = dict()
+
+    for content in load_blocks(0):
+        data = json.dumps(content).encode('utf-8')
+        index[str(content['number'])] = data
+        index[content['hash']] = data
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            # Supports '/blocks/{block}' as well as '/blocks?num={block}'
+            block_id = self.path.rsplit('/', 1)[-1].rsplit('=', 1)[-1]
+            data = index.get(block_id, b'{"error": "Block not found"}')
+
+            time.sleep(delay)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    print(f'Serving {len(index) // 2} blocks on port {port}')
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    app()
@@ -1,5 +1,23 @@
+import standards
+
+
 class Block:
 
+    # Derived fields are computed on first access. Slots that are
+    # not assigned yet raise AttributeError, which marks them as missing.
+    __slots__ = (
+        '_content',
+        '_exists',
+        '_hash',
+        '_timestamp',
+        '_number',
+        '_prev',
+        '_tx',
+        '_addresses',
+        '_sender',
+        '_standards'
+    )
+
     def __init__(self, content: dict, exists: bool = False):
         # Whole block content
         self._content = content
@@ -19,88 +37,13 @@ class Block:
         # Previous block hash
         self._prev = content['previous']
 
-        if 'rewards' in content:
-            # Distributed rewards to node owners
-            self._rewards = content['rewards']
-        else:
-            self._rewards = list()
-
-        if 'processed' in content:
-            # Save transaction
-            self._tx = content['processed']
-
-            # Save transaction hash
-            self._tx_hash = content['processed']['hash']
-
-            # Check for state in transaction
-            if 'state' in content['processed']:
-                # If present, save as state
-                self._state = content['processed']['state']
-
-                # Remove state from transaction itself
-                del self._tx['state']
-            else:
-                self._state = list()
-
-            # Transaction was valid or not
-            status = content['processed']['status']
-            self._tx_is_valid = True if status == 0 else False
-
-            # If transaction is not valid then 'result' has the error msg
-            result = content['processed']['result']
-            self._result = None if result == "None" else result
-
-            # Transaction payload
-            pld = content['processed']['transaction']['payload']
-            con = pld['contract']
-            fun = pld['function']
-
-            self._addresses = set()
-
-            # Check FROM address
-            if self.is_valid_address(pld['sender']):
-                self._addresses.add(pld['sender'])
-                # Save sender address
-                self._sender = pld['sender']
-            # Check TO address (if it exists)
-            if 'kwargs' in pld and 'to' in pld['kwargs']:
-                if self.is_valid_address(pld['kwargs']['to']):
-                    self._addresses.add(pld['kwargs']['to'])
-
-            # Check if new contract was submitted
-            if con == 'submission' and fun == 'submit_contract':
-                kwargs = pld['kwargs']
-
-                self._is_new_contract = True
-                self._contract = kwargs['name']
-                self._code = kwargs['code']
-
-                self._is_lst001 = self.con_is_lst001(kwargs['code'])
-                self._is_lst002 = self.con_is_lst002(kwargs['code'])
-                self._is_lst003 = self.con_is_lst003(kwargs['code'])
-            else:
-                self._is_new_contract = False
-                self._contract = None
-                self._code = None
-
-                self._is_lst001 = False
-                self._is_lst002 = False
-                self._is_lst003 = False
-        else:
-            self._tx = None
-            self._tx_hash = None
-            self._tx_is_valid = False
-            self._result = None
-            self._state = list()
-            self._addresses = set()
-
-            self._is_new_contract = False
-            self._contract = None
-            self._code = None
+    @property
+    def _processed(self) -> dict:
+        return self._content.get('processed')
 
-            self._is_lst001 = False
-            self._is_lst002 = False
-            self._is_lst003 = False
+    @property
+    def _payload(self) -> dict:
+        return self._content['processed']['transaction']['payload']
 
     @property
     def exists(self) -> bool:
@@ -128,108 +71,128 @@ class Block:
 
     @property
     def tx(self) -> dict:
+        try:
+            return self._tx
+        except AttributeError:
+            pass
+
+        # Transaction without state - state is saved separately
+        if self._processed:
+            self._tx = {k: v for k, v in self._processed.items() if k != 'state'}
+        else:
+            self._tx = None
+
         return self._tx
 
     @property
     def tx_hash(self) -> str:
-        return self._tx_hash
+        return self._processed['hash'] if self._processed else None
+
+    @property
+    def tx_contract(self) -> str:
+        return self._payload['contract'] if self._processed else None
+
+    @property
+    def tx_function(self) -> str:
+        return self._payload['function'] if self._processed else None
 
     @property
     def tx_is_valid(self) -> bool:
-        return self._tx_is_valid
+        return bool(self._processed) and self._processed['status'] == 0
 
     @property
     def result(self) -> str:
-        return self._result
+        # If transaction is not valid then 'result' has the error msg
+        if not self._processed or self._processed['result'] == "None":
+            return None
+        return self._processed['result']
 
     @property
     def sender(self) -> str:
+        try:
+            return self._sender
+        except AttributeError:
+            pass
+
+        sender = self._payload['sender'] if self._processed else None
+        self._sender = sender if self.is_valid_address(sender) else None
+
         return self._sender
 
     @property
     def state(self) -> list:
-        return self._state
+        return self._processed.get('state', list()) if self._processed else list()
 
     @property
     def rewards(self) -> list:
-        return self._rewards
+        # Distributed rewards to node owners
+        return self._content.get('rewards', list())
 
     @property
     def is_new_contract(self) -> bool:
-        return self._is_new_contract
+        if not self._processed:
+            return False
+
+        pld = self._payload
+        return pld['contract'] == 'submission' and pld['function'] == 'submit_contract'
 
     @property
     def contract(self) -> str:
-        return self._contract
+        return self._payload['kwargs']['name'] if self.is_new_contract else None
 
     @property
     def code(self) -> str:
-        return self._code
+        return self._payload['kwargs']['code'] if self.is_new_contract else None
 
     @property
     def is_lst001(self) -> bool:
-        return self._is_lst001
+        return self._lst_standards()[0]
 
     @property
     def is_lst002(self) -> bool:
-        return self.is_lst002
+        return self._lst_standards()[1]
 
     @property
     def is_lst003(self) -> bool:
-        return self.is_lst003
+        return self._lst_standards()[2]
 
     @property
     def addresses(self) -> list:
-        return list(self._addresses)
-
-    @staticmethod
-    def con_is_lst001(code: str) -> bool:
-        code = code.replace(' ', '')
+        try:
+            return list(self._addresses)
+        except AttributeError:
+            pass
 
-        if 'balances=Hash(' not in code:
-            return False
-        if '@export\ndeftransfer(amount:float,to:str):' not in code:
-            return False
-        if '@export\ndefapprove(amount:float,to:str):' not in code:
-            return False
-        if '@export\ndeftransfer_from(amount:float,to:str,main_account:str):' not in code:
-            return False
+        addresses = list()
 
-        return True
+        if self._processed:
+            pld = self._payload
 
-    @staticmethod
-    def con_is_lst002(code: str) -> bool:
-        code = code.replace(' ', '')
+            # Check FROM address
+            if self.sender:
+                addresses.append(self.sender)
 
-        if 'metadata=Hash(' not in code:
-            return False
+            # Check TO address (if it exists)
+            if 'kwargs' in pld and 'to' in pld['kwargs']:
+                if self.is_valid_address(pld['kwargs']['to']) and pld['kwargs']['to'] not in addresses:
+                    addresses.append(pld['kwargs']['to'])
 
-        return True
+        self._addresses = tuple(addresses)
+        return list(self._addresses)
 
-    @staticmethod
-    def con_is_lst003(code: str) -> bool:
-        code = code.replace(' ', '')
+    def _lst_standards(self) -> tuple:
+        try:
+            return self._standards
+        except AttributeError:
+            pass
 
-        if 'collection_name=Variable()' not in code:
-            return False
-        if 'collection_owner=Variable()' not in code:
-            return False
-        if 'collection_nfts=Hash(' not in code:
-            return False
-        if 'collection_balances=Hash(' not in code:
-            return False
-        if 'collection_balances_approvals=Hash(' not in code:
-            return False
-        if '@export\ndefmint_nft(name:str,description:str,ipfs_image_url:str,metadata:dict,amount:int):' not in code:
-            return False
-        if '@export\ndeftransfer(name:str,amount:int,to:str):' not in code:
-            return False
-        if '@export\ndefapprove(amount:int,name:str,to:str):' not in code:
-            return False
-        if '@export\ndeftransfer_from(name:str,amount:int,to:str,main_account:str):' not in code:
-            return False
+        if self.is_new_contract:
+            found = standards.classify(self.code)
+            self._standards = ('lst001' in found, 'lst002' in found, 'lst003' in found)
+        else:
+            self._standards = (False, False, False)
 
-        return True
+        return self._standards
 
     @staticmethod
     def is_valid_address(address: str) -> bool:
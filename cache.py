@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+# Tag that invalidates every entry
+ALL = '*'
+
+
+class ResponseCache:
+    """ LRU cache with a time to live. Entries are tagged with the data they depend on and invalidated by tag """
+
+    def __init__(self, size: int = 1000, ttl: float = 60):
+        self._size = size
+        self._ttl = ttl
+
+        # Key -> (expiry, tags, value)
+        self._entries = OrderedDict()
+        # Tag -> keys
+        self._tags = dict()
+
+        # Incremented with every invalidation
+        self.generation = 0
+
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _remove(self, key):
+        _, tags, _ = self._entries.pop(key)
+
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys: del self._tags[tag]
+
+    def get(self, key) -> tuple:
+        """ Tuple of 'found' and the cached value """
+
+        entry = self._entries.get(key)
+
+        if entry and entry[0] < timer():
+            self._remove(key)
+            self._stats['expirations'] += 1
+            entry = None
+
+        if not entry:
+            self._stats['misses'] += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        self._stats['hits'] += 1
+        return True, entry[2]
+
+    def put(self, key, value, tags: tuple = (), generation: int = None):
+        # Data changed while the value was retrieved - it might be outdated already
+        if generation is not None and generation != self.generation:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (timer() + self._ttl, tuple(tags), value)
+
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self._size:
+            self._remove(next(iter(self._entries)))
+            self._stats['evictions'] += 1
+
+    def invalidate(self, tags):
+        self.generation += 1
+
+        if ALL in tags:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+            return
+
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self._stats['invalidations'] += 1
+
+    def stats(self) -> dict:
+        lookups = self._stats['hits'] + self._stats['misses']
+        hit_rate = round(self._stats['hits'] / lookups, 4) if lookups else 0
+        return {**self._stats, 'size': len(self._entries), 'hit_rate': hit_rate}
@@ -0,0 +1,48 @@
+import sql
+
+from bisect import bisect_left
+from database import DB
+from threading import local
+
+# Saved blocks loaded per query
+WINDOW_SIZE = 10000
+
+
+class ChainIndex:
+    """ Number, hash and previous hash of saved blocks, loaded in windows while the chain is walked backwards.
+    Tells if the block a saved block points to is saved too, without a query per block """
+
+    db = None
+
+    def __init__(self, database: DB, size: int = None):
+        self.db = database
+
+        self._size = size or WINDOW_SIZE
+        # Every fetcher thread walks its own part of the chain
+        self._local = local()
+
+    def _load(self, upper: int):
+        rows = self.db.execute(sql.select_chain_window(), {'n': upper, 'l': self._size}, prepare=True)
+        rows.reverse()
+
+        window = self._local
+        window.upper = upper
+        window.numbers = [row[0] for row in rows]
+        window.rows = rows
+        # Fewer rows than requested - there are no saved blocks below the window
+        window.complete = len(rows) < self._size
+
+    def below(self, number: int) -> tuple:
+        """ Number, hash and previous hash of the highest saved block below 'number' - None if there is none """
+
+        window = self._local
+
+        # Window has to contain all saved blocks between the block and 'number'
+        covered = getattr(window, 'upper', None) is not None and number <= window.upper
+        pos = bisect_left(window.numbers, number) if covered else 0
+
+        if not covered or (pos == 0 and not window.complete):
+            self._load(number)
+            pos = len(window.rows)
+
+        return window.rows[pos - 1] if pos else None
@@ -0,0 +1,68 @@
+import os
+import json
+import utils
+import atexit
+
+from config import Config
+from loguru import logger
+from threading import Lock
+from timeit import default_timer as timer
+
+# Sync progress that used to be saved in cfg/sync.json
+KEYS = ('block_latest', 'genesis_processed', 'sync_end', 'sync_start')
+
+
+class Checkpoint:
+    """ Sync progress - kept in memory and flushed to file on an interval and on shutdown """
+
+    cfg = None
+
+    def __init__(self, config: Config):
+        self.cfg = config
+
+        self._file = self.cfg.get('checkpoint_file')
+        # Flush after this many seconds or changes
+        self._interval = self.cfg.get('checkpoint_interval') or 10
+        self._count = self.cfg.get('checkpoint_count') or 100
+
+        self._lock = Lock()
+        self._data = self._load()
+        self._dirty = 0
+        self._flushed = timer()
+
+        atexit.register(self.flush)
+
+    def _load(self) -> dict:
+        if os.path.isfile(self._file):
+            with open(self._file, encoding='utf-8') as f:
+                return json.load(f)
+
+        # Take over progress from static configuration
+        return {key: self.cfg.get(key) for key in KEYS}
+
+    def get(self, key: str):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key: str, value, flush: bool = False):
+        with self._lock:
+            if self._data.get(key) != value:
+                self._data[key] = value
+                self._dirty += 1
+
+            due = self._dirty >= self._count or timer() - self._flushed >= self._interval
+
+        if flush or due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            utils.write_atomic(self._file, json.dumps(self._data, sort_keys=True, indent=4))
+
+            self._dirty = 0
+            self._flushed = timer()
+
+        logger.trace(f'Saved checkpoint to {self._file}')
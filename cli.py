@@ -1,19 +1,28 @@
 import os
 import sys
+import sql
+import json
 import typer
+import standards
 
 from typing import List
+from pathlib import Path
 from loguru import logger
 
-from block import State
 from sync import Sync
+from block import Block
+from archive import BlockArchive
+from reindex import Reindexer
+from partitions import Partitions
+from fetcher import Segment
+from cache import ALL
 from config import Config
 from database import DB
 from datetime import timedelta
 from tgbot import TelegramBot
 from timeit import default_timer as timer
+from psycopg2.extras import execute_values
 
-# TODO: Check if all blocks are in DB
 # TODO: Check if all blocks on HDD
 # TODO: Add possibility to execute raw SQL statement with no predefined statement
 
@@ -44,11 +53,8 @@ def sync_blocks(block_nums: List[int]):
     start_time = timer()
 
     try:
-        for block_num in block_nums:
-            block = sync.get_block(block_num)
-
-            if block.exists == State.NEW:
-                sync.process_block(block)
+        # Blocks are retrieved concurrently
+        sync.fetcher.run([Segment(block_num, None) for block_num in block_nums])
     except Exception as e:
         logger.exception(e)
         return
@@ -66,4 +72,174 @@ def sync_blocks_from(from_block_num: int, check_db: bool = True):
     sync.sync(start=from_block_num, end=0, check_db=check_db)
 
 
-app()
+@app.command()
+def reclassify_contracts(page_size: int = 1000):
+    start_time = timer()
+    total, updated, name = 0, 0, ''
+
+    # Page through contracts by name and update only rows that changed
+    while True:
+        rows = db.execute(sql.select_contract_codes(), {'n': name, 'l': page_size})
+
+        if not rows:
+            break
+
+        values = list()
+        for name, code in rows:
+            found = standards.classify(code)
+            values.append((name, 'lst001' in found, 'lst002' in found, 'lst003' in found))
+
+        with db.transaction() as cur:
+            execute_values(cur, sql.update_contract_standards(), values, page_size=page_size)
+            updated += cur.rowcount
+            sync.notify(cur, ['contracts'] + [f'contract:{v[0]}' for v in values])
+
+        total += len(rows)
+
+    logger.info(f'Reclassified {total} contracts, {updated} updated - {timer() - start_time:.3f} seconds')
+
+
+@app.command()
+def create_indexes():
+    # Indexes that failed to build concurrently stay invalid and need to be rebuilt
+    for (name,) in db.execute(sql.select_invalid_indexes()) or []:
+        logger.warning(f'Dropping invalid index {name}')
+        db.execute(sql.drop_index(name))
+
+    # Suffix searches on state keys are gone - the index only slowed down state writes
+    db.execute(sql.drop_index('state_key_reverse_idx'))
+
+    # Built concurrently so that sync and API keep working meanwhile - partitioned tables get them when created
+    concurrently = sync.partitions is None
+
+    for query in (sql.create_state_key_index(), sql.create_blocks_chain_index(concurrently),
+                  sql.create_blocks_hash_index(concurrently)):
+        start_time = timer()
+        db.execute(query)
+        logger.info(f'{query.strip()} - {timer() - start_time:.3f} seconds')
+
+
+@app.command()
+def fill_previous(page_size: int = 10000):
+    start_time = timer()
+    total = 0
+
+    db.execute(sql.add_blocks_previous())
+
+    # In pages so that rows are not locked for long
+    while True:
+        with db.transaction() as cur:
+            cur.execute(sql.update_blocks_previous(), {'l': page_size})
+            rows = cur.rowcount
+
+        if not rows:
+            break
+
+        total += rows
+        logger.info(f'Filled previous hash of {total} blocks')
+
+    logger.info(f'Filled previous hash of {total} blocks - {timer() - start_time:.3f} seconds')
+
+
+@app.command()
+def partition_tables(size: int = 0):
+    """ Convert blocks, transactions and rewards into tables partitioned by block number - sync and API must not run meanwhile """
+
+    size = size or db.cfg.get('db_partition_size')
+
+    if not size:
+        logger.error('No partition size - set db_partition_size in cfg/db.json')
+        return
+
+    if db.execute(sql.select_partitioned())[0][0]:
+        logger.info('Tables are already partitioned')
+        return
+
+    Partitions(db, size).migrate()
+
+
+@app.command()
+def find_gaps():
+    for segment in sync.find_gaps():
+        logger.info(f'Blocks missing below {segment.start} down to block {segment.end}')
+
+
+@app.command()
+def backfill():
+    sync.backfill()
+
+
+@app.command()
+def rebuild_balances():
+    start_time = timer()
+
+    with db.transaction() as cur:
+        cur.execute(sql.insert_all_balances())
+        rows = cur.rowcount
+        sync.notify(cur, [ALL])
+
+    logger.info(f'Rebuilt {rows} balances from state - {timer() - start_time:.3f} seconds')
+
+
+@app.command()
+def seed_history():
+    """ Start the state history at the current state. Values from before can only be saved by syncing
+    the blocks from the network again - blocks saved before state was kept in them can't restore them """
+
+    start_time = timer()
+
+    with db.transaction() as cur:
+        cur.execute(sql.insert_state_history_from_state())
+        rows = cur.rowcount
+
+    logger.info(f'Saved current value of {rows} keys to state history - {timer() - start_time:.3f} seconds')
+
+
+@app.command()
+def archive_import(block_dir: str, batch_size: int = 1000):
+    """ Add blocks saved as one JSON file per block to the archive - sync must not run meanwhile """
+
+    start_time = timer()
+    archive = sync.archive if sync.archive is not None else BlockArchive(sync.cfg.get('archive_dir'))
+    files = sorted(Path(block_dir).glob('*.json'), key=lambda p: int(p.stem))
+    added = 0
+
+    for i in range(0, len(files), batch_size):
+        blocks = list()
+        for path in files[i:i + batch_size]:
+            with open(path, encoding='utf-8') as f:
+                blocks.append(Block(json.load(f)))
+
+        added += archive.append(blocks)
+        logger.info(f'Imported {i + len(blocks)} of {len(files)} block files')
+
+    archive.close()
+    logger.info(f'Added {added} blocks to archive {archive.path} - {timer() - start_time:.3f} seconds')
+
+
+@app.command()
+def reindex(source: str = 'archive', rebuild: bool = False, force: bool = False, workers: int = 0, batch_size: int = 500):
+    """ Replay blocks from 'archive', 'db' (the blocks table) or a directory - sync must not run meanwhile.
+    With --rebuild all derived tables are emptied first. Block files and rows of the blocks table that were
+    saved before blocks kept the state of their transaction can't rebuild the state - --rebuild refuses
+    such sources unless --force is given """
+
+    reindexer = Reindexer(sync, workers=workers, batch_size=batch_size)
+
+    # Derived tables are built from scratch
+    if rebuild:
+        stateless = reindexer.stateless(source)
+
+        if stateless and not force:
+            logger.error(f'{stateless} sampled blocks of {source} have no state - '
+                         f'rebuilding would lose state and balances')
+            return
+
+        reindexer.rebuild()
+
+    reindexer.run(source)
+
+
+# Worker processes of 'reindex' might import this module
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,148 @@
+import time
+import fastjson
+import random
+import requests as r
+
+from config import Config
+from loguru import logger
+from hosts import HostSelector
+from archive import BlockArchive
+from threading import BoundedSemaphore
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from timeit import default_timer as timer
+
+# Hosts like 'archive:///path/to/archive' read from a local block archive
+ARCHIVE = 'archive://'
+
+
+class BlockClient:
+    """ Retrieves blocks from the 'retrieve_from' hosts over keep-alive connections """
+
+    cfg = None
+
+    def __init__(self, config: Config):
+        self.cfg = config
+
+        # (connect, read) timeout in seconds
+        self._timeout = tuple(self.cfg.get('retrieve_timeout') or (5, 30))
+
+        # Retries per host with exponential backoff
+        self._retries = self.cfg.get('retrieve_retries') or 0
+        self._backoff = self.cfg.get('retrieve_backoff') or 0.5
+        self._backoff_max = self.cfg.get('retrieve_backoff_max') or 10
+
+        self._hosts = list()
+        self._slots = dict()
+        self._archives = dict()
+        self._session = r.Session()
+
+        for source in self.cfg.get('retrieve_from'):
+            host = source['host']
+            concurrency = source.get('concurrency') or 1
+
+            self._hosts.append(host)
+            self._slots[host] = BoundedSemaphore(concurrency)
+
+            if host.startswith(ARCHIVE):
+                self._archives[host] = BlockArchive(host[len(ARCHIVE):])
+                continue
+
+            # Own connection pool per host, sized to its concurrency
+            url = urlsplit(host)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+            self._session.mount(f'{url.scheme}://{url.netloc}/', adapter)
+
+        # Routes requests to the fastest healthy host
+        self._selector = HostSelector(self.cfg, self._hosts)
+
+    @property
+    def hosts(self) -> list:
+        return list(self._hosts)
+
+    def close(self):
+        self._session.close()
+
+        for archive in self._archives.values():
+            archive.close()
+
+    def stats(self) -> dict:
+        return self._selector.stats()
+
+    def get(self, block_id: (int, str)) -> dict:
+        """ Try hosts from fastest to slowest and return the first block found """
+
+        for host in self._selector.order():
+            content = self.get_from(host, block_id)
+
+            if content:
+                return content
+
+    def get_from(self, host: str, block_id: (int, str)) -> dict:
+        if host in self._archives:
+            return self.get_from_archive(host, block_id)
+
+        url = host.replace('{block}', str(block_id))
+
+        for attempt in range(self._retries + 1):
+            # Circuit opened - don't wait for this host
+            if attempt and not self._selector.available(host):
+                logger.debug(f'Skipping {url} - host failing')
+                return None
+
+            if attempt:
+                delay = min(self._backoff * 2 ** (attempt - 1), self._backoff_max)
+                delay *= random.uniform(0.5, 1)
+                logger.debug(f'Retrying block {block_id} from {url} in {delay:.2f} seconds...')
+                time.sleep(delay)
+
+            try:
+
+                with self._slots[host]:
+                    start = timer()
+
+                    with self._session.get(url, timeout=self._timeout) as response:
+                        response.raise_for_status()
+                        content = fastjson.loads(response.content)
+
+                    latency = timer() - start
+
+            except (RequestException, ValueError) as e:
+                logger.warning(f'Can not retrieve block {block_id} from {url}: {repr(e)}')
+                self._selector.record(host, error=True)
+                continue
+
+            logger.trace(f'Block {block_id} --> {content}')
+
+            if 'error' in content:
+                # Block Service does not know block
+                logger.debug(f'Block {block_id} unknown to {url}')
+                self._selector.record(host, latency=latency, unknown=True)
+                return None
+
+            self._selector.record(host, latency=latency)
+            return content
+
+        logger.error(f'Can not retrieve block {block_id} from {url} - giving up after {self._retries + 1} tries')
+
+    def get_from_archive(self, host: str, block_id: (int, str)) -> dict:
+        try:
+
+            with self._slots[host]:
+                start = timer()
+                content = self._archives[host].get(block_id)
+                latency = timer() - start
+
+        except (OSError, ValueError) as e:
+            logger.warning(f'Can not retrieve block {block_id} from {host}: {repr(e)}')
+            self._selector.record(host, error=True)
+            return None
+
+        if not content:
+            logger.debug(f'Block {block_id} unknown to {host}')
+            self._selector.record(host, latency=latency, unknown=True)
+            return None
+
+        self._selector.record(host, latency=latency)
+        return content
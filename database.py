@@ -1,9 +1,130 @@
 import os
+import re
+import hashlib
+import fastjson
 import psycopg2
+import psycopg2.extras
 
 from loguru import logger
 from config import Config
-from psycopg2 import OperationalError
+from contextlib import contextmanager
+from collections import OrderedDict
+from timeit import default_timer as timer
+from threading import BoundedSemaphore, Lock
+from psycopg2 import OperationalError, InterfaceError
+from psycopg2.errors import InvalidSqlStatementName
+from psycopg2.pool import ThreadedConnectionPool
+
+# Named parameters like %(name)s and escaped percent signs
+_PARAMS = re.compile(r'%\((\w+)\)s|%%')
+
+# Number of prepared statements kept per connection
+PREPARED_MAX = 100
+
+# Decode JSON columns with the fastest available library
+psycopg2.extras.register_default_json(globally=True, loads=fastjson.loads)
+psycopg2.extras.register_default_jsonb(globally=True, loads=fastjson.loads)
+
+
+def positional(query: str) -> tuple:
+    """ Query with $1, $2, ... instead of named parameters and the names in that order """
+
+    names = list()
+
+    def placeholder(match):
+        if not match.group(1):
+            return '%'
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f'${names.index(match.group(1)) + 1}'
+
+    return _PARAMS.sub(placeholder, query), names
+
+
+class _RowFile:
+    """ File-like object that feeds rows to COPY while they are generated """
+
+    def __init__(self, rows):
+        self.rows = 0
+
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def _encode(self, value) -> str:
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+
+        while size < 0 or length < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+
+            line = '\t'.join(self._encode(v) for v in row) + '\n'
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+
+        data = ''.join(chunks)
+
+        if size < 0:
+            self._buffer = ''
+            return data
+
+        self._buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """ Connection that prepares every distinct statement once and only executes it afterwards """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared = OrderedDict()
+
+    def prepare(self, query: str) -> tuple:
+        """ Name and parameter names of the prepared statement for the query """
+
+        if query in self._prepared:
+            self._prepared.move_to_end(query)
+            return self._prepared[query]
+
+        name = f'stmt_{hashlib.md5(query.encode("utf-8")).hexdigest()}'
+        statement, names = positional(query)
+
+        with self.cursor() as cur:
+            cur.execute(f'PREPARE {name} AS {statement}')
+
+            if len(self._prepared) >= PREPARED_MAX:
+                _, (oldest, _) = self._prepared.popitem(last=False)
+                cur.execute(f'DEALLOCATE {oldest}')
+
+        self._prepared[query] = (name, names)
+        return name, names
+
+    def execute_prepared(self, cur, query: str, params: dict = None, retry: bool = True):
+        name, names = self.prepare(query)
+        args = ', '.join(f'%({n})s' for n in names)
+
+        try:
+            cur.execute(f'EXECUTE {name}({args})' if names else f'EXECUTE {name}', params)
+        except InvalidSqlStatementName:
+            if not retry:
+                raise
+
+            # Statements got discarded on the server - prepare all again
+            cur.execute('DEALLOCATE ALL')
+            self._prepared.clear()
+            self.execute_prepared(cur, query, params, retry=False)
 
 
 class DB:
@@ -16,7 +137,15 @@ class DB:
     _db_host = None
     _db_port = None
 
-    def __init__(self, config: Config):
+    _pool = None
+    _pool_min = None
+    _pool_max = None
+    _pool_check = None
+    _pool_lock = None
+    _pool_slots = None
+    _last_used = None
+
+    def __init__(self, config: Config, pooled: bool = True):
         self.cfg = config
 
         self._db_name = self.cfg.get('db_name')
@@ -25,6 +154,24 @@ class DB:
         self._db_host = self.cfg.get('db_host')
         self._db_port = self.cfg.get('db_port')
 
+        # Pool size - a maximum of 0 disables pooling
+        self._pool_min = self.cfg.get('db_pool_min') or 1
+        self._pool_max = self.cfg.get('db_pool_max') if pooled else 0
+        if self._pool_max is None: self._pool_max = 10
+
+        # Seconds a connection can be idle before it gets checked on checkout
+        self._pool_check = self.cfg.get('db_pool_check')
+
+        self._pool_lock = Lock()
+        self._last_used = dict()
+
+        if self._pool_max:
+            self._pool_slots = BoundedSemaphore(self._pool_max)
+
+    @property
+    def pooled(self) -> bool:
+        return bool(self._pool_max)
+
     def _connect(self):
         try:
             connection = psycopg2.connect(
@@ -40,21 +187,166 @@ class DB:
         except OperationalError as e:
             logger.exception(f'Error while connecting to DB: {e}')
 
-    def execute(self, query: str, params: dict = None):
-        con = cur = None
+    def _get_pool(self) -> ThreadedConnectionPool:
+        # Pool is created lazily so that importing modules doesn't need a running DB
+        with self._pool_lock:
+            if not self._pool:
+                logger.debug(f'Creating DB connection pool ({self._pool_min} - {self._pool_max} connections)')
+
+                self._pool = ThreadedConnectionPool(
+                    min(self._pool_min, self._pool_max),
+                    self._pool_max,
+                    database=self._db_name,
+                    user=self._db_user,
+                    password=self._db_pass,
+                    host=self._db_host,
+                    port=self._db_port,
+                    connection_factory=PreparingConnection)
+
+            return self._pool
+
+    def _is_healthy(self, con) -> bool:
+        if con.closed:
+            return False
+
+        # Only ping connections that have been idle for a while
+        if self._pool_check is None:
+            return True
+        if timer() - self._last_used.get(id(con), 0) < self._pool_check:
+            return True
 
         try:
+            with con.cursor() as cur:
+                cur.execute('SELECT 1')
+            return True
+        except (OperationalError, InterfaceError) as e:
+            logger.warning(f'Discarding broken DB connection: {e}')
+            return False
+
+    def _checkout(self):
+        pool = self._get_pool()
+
+        # Block instead of failing if all connections are in use
+        self._pool_slots.acquire()
+
+        try:
+            while True:
+                con = pool.getconn()
+
+                if not con.closed:
+                    con.autocommit = True
+
+                if self._is_healthy(con):
+                    return con
+
+                pool.putconn(con, close=True)
+                self._last_used.pop(id(con), None)
+
+        except Exception:
+            self._pool_slots.release()
+            raise
+
+    def _checkin(self, con, broken: bool = False):
+        try:
+            if not broken and not con.closed:
+                # Never hand out a connection with an open transaction
+                if con.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    con.rollback()
+                self._last_used[id(con)] = timer()
+            else:
+                self._last_used.pop(id(con), None)
+
+            self._pool.putconn(con, close=broken or bool(con.closed))
+        finally:
+            self._pool_slots.release()
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection - from the pool if pooling is enabled """
+
+        if not self.pooled:
             con = self._connect()
-            cur = con.cursor()
+            try:
+                yield con
+            finally:
+                if con: con.close()
+            return
 
-            cur.execute(query, params)
-            return cur.fetchall()
+        con = self._checkout()
+        broken = False
+
+        try:
+            yield con
+        except (OperationalError, InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(con, broken=broken)
+
+    @contextmanager
+    def transaction(self):
+        """ Cursor whose statements are committed together or not at all """
+
+        with self.connection() as con:
+            con.autocommit = False
+
+            try:
+                with con.cursor() as cur:
+                    yield cur
+                con.commit()
+            except BaseException:
+                # Also if a generator using the transaction gets closed early
+                if not con.closed: con.rollback()
+                raise
+            finally:
+                if not con.closed: con.autocommit = True
+
+    def stream(self, query: str, params: dict = None, size: int = 1000):
+        """ Rows of the query fetched in chunks by a server-side cursor instead of all at once """
+
+        with self.transaction() as cur:
+            with cur.connection.cursor(name=f'stream_{id(cur)}') as named:
+                named.itersize = size
+                named.execute(query, params)
+                yield from named
+
+    @staticmethod
+    def copy(cur, query: str, rows) -> int:
+        """ Stream rows into a 'COPY ... FROM STDIN' statement and return the number of rows """
+
+        data = _RowFile(rows)
+        cur.copy_expert(query, data)
+        return data.rows
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+    def execute(self, query: str, params: dict = None, retry: bool = True, prepare: bool = False):
+        """ Prepared statements are only used with pooled connections - others would be closed right away """
+
+        try:
+            with self.connection() as con:
+                with con.cursor() as cur:
+                    if prepare and self.pooled and not isinstance(params, (list, tuple)):
+                        con.execute_prepared(cur, query, params)
+                    else:
+                        cur.execute(query, params)
+                    return cur.fetchall()
+
+        except (OperationalError, InterfaceError) as e:
+            # Connection got lost - try once more with a new one
+            if retry and self.pooled:
+                logger.warning(f'DB connection failed, reconnecting: {e}')
+                return self.execute(query, params, retry=False, prepare=prepare)
+
+            logger.exception(f'Error while executing SQL: {e}')
+            raise e
 
         except Exception as e:
             if 'no results to fetch' not in str(e):
                 logger.exception(f'Error while executing SQL: {e}')
                 raise e
-
-        finally:
-            if cur: cur.close()
-            if con: con.close()
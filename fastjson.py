@@ -0,0 +1,98 @@
+import json
+
+from decimal import Decimal
+
+# Fastest available JSON library - orjson, ujson or the standard library
+orjson, ujson = None, None
+
+try:
+    import orjson
+    BACKEND = 'orjson'
+except ImportError:
+    try:
+        import ujson
+        BACKEND = 'ujson'
+    except ImportError:
+        BACKEND = 'json'
+
+
+# orjson 3.9 and newer insert JSON text as it is - older versions have to decode it first
+_fragment = getattr(orjson, 'Fragment', None)
+
+
+class RawJSON(str):
+    """ Text that is JSON already - inserted as it is instead of being encoded as string """
+
+
+def _default(value):
+    if isinstance(value, RawJSON):
+        return _fragment(str(value)) if _fragment else orjson.loads(str(value))
+    # Decimals like FastAPI encodes them
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    # Subclasses of builtin types
+    for builtin in (bool, int, str, dict, list):
+        if isinstance(value, builtin):
+            return builtin(value)
+    return str(value)
+
+
+def _plain(obj):
+    # Other libraries encode RawJSON as string - it needs to be decoded for them
+    if isinstance(obj, RawJSON):
+        return json.loads(obj)
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    return obj
+
+
+def dumps_bytes(obj) -> bytes:
+    """ Compact UTF-8 encoded JSON """
+
+    if orjson:
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_PASSTHROUGH_SUBCLASS)
+        except TypeError:
+            # Integers with more than 64 bit
+            pass
+
+    return dumps(obj).encode('utf-8')
+
+
+def dumps(obj) -> str:
+    """ Compact JSON """
+
+    if orjson:
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_PASSTHROUGH_SUBCLASS).decode('utf-8')
+        except TypeError:
+            # Integers with more than 64 bit
+            pass
+
+    obj = _plain(obj)
+
+    if ujson:
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=_default)
+        except (TypeError, OverflowError):
+            pass
+
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(data):
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Numbers out of range and other input the standard library accepts
+            pass
+    elif ujson:
+        try:
+            return ujson.loads(data)
+        except (ValueError, OverflowError):
+            pass
+
+    return json.loads(data)
@@ -0,0 +1,152 @@
+import queue
+
+from config import Config
+from loguru import logger
+from metrics import Metrics
+from threading import Thread, Event, Lock
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+# Part of the chain to walk backwards - from 'start' (block number or hash)
+# down to block number 'end'. If 'end' is None only 'start' is retrieved.
+Segment = namedtuple('Segment', ['start', 'end'])
+
+
+class Fetcher:
+    """ Retrieves chain segments with a pool of workers and hands the blocks to a separate writer """
+
+    cfg = None
+    metrics = None
+
+    def __init__(self, config: Config, get_block, write, metrics: Metrics):
+        self.cfg = config
+        self.metrics = metrics
+
+        self._get_block = get_block
+        self._write = write
+
+        self._failed = Event()
+        # Set on shutdown - fetched blocks that aren't written yet are fetched again on next start
+        self._stop = Event()
+        # One run at a time - sync and backfill share the fetcher
+        self._lock = Lock()
+        self._fetched = 0
+        self._written = 0
+        self._started = None
+        self._reported = None
+
+    def stop(self):
+        """ Let workers and writer end after their current block """
+        self._stop.set()
+
+    def run(self, segments: list, check_db: bool = True, on_progress=None) -> list:
+        """ Walk all segments and return the ones that could be walked completely """
+
+        with self._lock:
+            return self._run(segments, check_db, on_progress)
+
+    def _run(self, segments: list, check_db: bool, on_progress) -> list:
+        workers = self.cfg.get('fetch_workers') or 1
+        blocks = queue.Queue(maxsize=self.cfg.get('fetch_queue_size') or 1000)
+
+        self._failed.clear()
+        self._fetched = self._written = 0
+        self._started = self._reported = timer()
+
+        errors = list()
+
+        writer = Thread(target=self._writer, args=[blocks, on_progress, errors], name='block_writer')
+        writer.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='block_fetcher') as executor:
+                done = list(executor.map(lambda s: self._walk(s, blocks, check_db), segments))
+        finally:
+            blocks.put(None)
+            writer.join()
+
+        if errors:
+            raise errors[0]
+
+        self._report(force=True)
+        return [segment for segment, ok in zip(segments, done) if ok]
+
+    def _walk(self, segment: Segment, blocks: queue.Queue, check_db: bool) -> bool:
+        block = self._get_block(segment.start, check_db=check_db)
+
+        while block and not self._failed.is_set() and not self._stop.is_set():
+            # Blocks if the writer falls behind
+            blocks.put((segment, block))
+
+            self._fetched += 1
+            self._report()
+
+            if segment.end is None or block.number <= segment.end or block.number == 0:
+                return True
+
+            block = self._get_block(block.prev, check_db=check_db, below=block.number)
+
+        return False
+
+    def _writer(self, blocks: queue.Queue, on_progress, errors: list):
+        batch_size = self.cfg.get('sync_batch_size') or 1
+        pending = list()
+
+        while True:
+            item = blocks.get()
+
+            if item is not None:
+                pending.append(item)
+
+            # Write if window is full, the fetchers are done or the writer caught up
+            if pending and (item is None or len(pending) >= batch_size or blocks.empty()):
+                if not self._failed.is_set() and not self._stop.is_set():
+                    try:
+                        self._flush(pending, on_progress)
+                    except Exception as e:
+                        logger.exception(f'Block writer failed: {e}')
+                        errors.append(e)
+                        self._failed.set()
+
+                pending = list()
+
+            if item is None:
+                break
+
+    def _flush(self, pending: list, on_progress):
+        # Restore chain order since segments are fetched concurrently
+        pending.sort(key=lambda item: item[1].number, reverse=True)
+
+        # Only process blocks that didn't come from DB
+        new = [b for _, b in pending if not b.exists and not b.number == 0]
+
+        if new:
+            self._write(new)
+            self._written += len(new)
+
+        if on_progress:
+            lowest = dict()
+            for segment, block in pending:
+                lowest[segment] = min(lowest.get(segment, block.number), block.number)
+            for segment, number in lowest.items():
+                on_progress(segment, number)
+
+    def _report(self, force: bool = False):
+        now = timer()
+        interval = self.cfg.get('fetch_progress_interval') or 10
+
+        if not force and now - self._reported < interval:
+            return
+
+        elapsed = max(now - self._started, 0.001)
+        rate = self._fetched / elapsed
+
+        self._reported = now
+
+        self.metrics.set('sync_blocks_fetched', self._fetched)
+        self.metrics.set('sync_blocks_written', self._written)
+        self.metrics.set('sync_blocks_per_sec', round(rate, 2))
+
+        logger.info(f'Sync progress --> {self._fetched} blocks fetched, '
+                    f'{self._written} written - {rate:.2f} blocks/sec')
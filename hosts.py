@@ -0,0 +1,119 @@
+from config import Config
+from threading import Lock
+from timeit import default_timer as timer
+
+# Weight of the newest sample in the moving averages
+ALPHA = 0.2
+
+# Seconds added to the score of a host that fails every request
+ERROR_PENALTY = 10
+
+
+class HostStats:
+
+    def __init__(self, host: str, position: int):
+        self.host = host
+        self.position = position
+
+        self.requests = 0
+        self.errors = 0
+        self.unknown = 0
+        # Requests that measured a latency - failed ones don't
+        self.samples = 0
+
+        # Moving averages
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.unknown_rate = 0.0
+
+        # Circuit breaker
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    @property
+    def score(self) -> float:
+        # Seconds - slow hosts, failing hosts and hosts that lag behind get penalized
+        return self.latency * (1 + 2 * self.unknown_rate) + self.error_rate * ERROR_PENALTY
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'unknown': self.unknown,
+            'latency': round(self.latency, 4),
+            'error_rate': round(self.error_rate, 4),
+            'unknown_rate': round(self.unknown_rate, 4),
+            'score': round(self.score, 4),
+            'circuit_open': self.open_until > timer(),
+            'circuit_trips': self.trips
+        }
+
+
+class HostSelector:
+    """ Tracks health of block sources and orders them by speed and reliability """
+
+    cfg = None
+
+    def __init__(self, config: Config, hosts: list):
+        self.cfg = config
+
+        # Consecutive errors that open the circuit of a host
+        self._max_failures = self.cfg.get('breaker_failures') or 3
+        # Seconds a circuit stays open - doubles with every trip in a row
+        self._open_secs = self.cfg.get('breaker_timeout') or 30
+        self._open_secs_max = self.cfg.get('breaker_timeout_max') or 600
+
+        self._lock = Lock()
+        self._stats = {host: HostStats(host, i) for i, host in enumerate(hosts)}
+
+    def order(self) -> list:
+        """ Healthy hosts sorted by score. Hosts with open circuit come last. """
+
+        now = timer()
+
+        with self._lock:
+            healthy = [s for s in self._stats.values() if s.open_until <= now]
+            broken = [s for s in self._stats.values() if s.open_until > now]
+
+        healthy.sort(key=lambda s: (s.score, s.position))
+        broken.sort(key=lambda s: s.open_until)
+
+        return [s.host for s in healthy + broken]
+
+    def available(self, host: str) -> bool:
+        return self._stats[host].open_until <= timer()
+
+    def record(self, host: str, latency: float = None, error: bool = False, unknown: bool = False):
+        with self._lock:
+            s = self._stats[host]
+            s.requests += 1
+
+            s.error_rate += ALPHA * (float(error) - s.error_rate)
+            s.unknown_rate += ALPHA * (float(unknown) - s.unknown_rate)
+
+            if latency is not None:
+                s.samples += 1
+                s.latency = latency if s.samples == 1 else s.latency + ALPHA * (latency - s.latency)
+
+            if unknown:
+                s.unknown += 1
+
+            if not error:
+                # Host answered - close circuit
+                s.failures = 0
+                s.trips = 0
+                return
+
+            s.errors += 1
+            s.failures += 1
+
+            if s.failures >= self._max_failures:
+                # Half-open after timeout - next error opens circuit again right away
+                s.failures = self._max_failures - 1
+                s.trips += 1
+                s.open_until = timer() + min(self._open_secs * 2 ** (s.trips - 1), self._open_secs_max)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {host: s.to_dict() for host, s in self._stats.items()}
@@ -0,0 +1,108 @@
+import queue
+import itertools
+
+from sync import Sync
+from block import Block
+from config import Config
+from loguru import logger
+from threading import Thread, Lock
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+# Number of recently processed block numbers remembered for deduplication
+RECENT_SIZE = 10000
+
+
+class BlockQueue:
+    """ Bounded queue for blocks from the websocket, processed by a fixed pool of workers """
+
+    cfg = None
+    sync = None
+
+    def __init__(self, config: Config, sync: Sync):
+        self.cfg = config
+        self.sync = sync
+
+        # Seconds to wait for a free slot before a block gets dropped
+        self._put_timeout = self.cfg.get('ingest_put_timeout') or 5
+        self._batch_size = self.cfg.get('sync_batch_size') or 1
+
+        # Lowest block number first
+        self._queue = queue.PriorityQueue(maxsize=self.cfg.get('ingest_queue_size') or 100)
+        self._counter = itertools.count()
+
+        self._lock = Lock()
+        self._pending = set()
+        self._recent = OrderedDict()
+
+        self.sync.metrics.register('ingest_queue_depth', self._queue.qsize)
+
+        for i in range(self.cfg.get('ingest_workers') or 1):
+            Thread(target=self._work, name=f'block_ingest_{i}', daemon=True).start()
+
+    def put(self, block: Block) -> bool:
+        with self._lock:
+            if block.number in self._pending or block.number in self._recent:
+                logger.debug(f'Block {block.number} already queued - skipped')
+                self.sync.metrics.inc('ingest_duplicates')
+                return False
+
+            self._pending.add(block.number)
+
+        try:
+            # Blocks the caller if workers fall behind
+            self._queue.put((block.number, next(self._counter), timer(), block), timeout=self._put_timeout)
+        except queue.Full:
+            # Not lost - the sync job retrieves blocks that are missing
+            logger.warning(f'Block queue full - dropped block {block.number}')
+            self.sync.metrics.inc('ingest_dropped')
+
+            with self._lock:
+                self._pending.discard(block.number)
+
+            return False
+
+        return True
+
+    def _take(self) -> list:
+        items = [self._queue.get()]
+
+        # Write whatever else is waiting together with it
+        while len(items) < self._batch_size:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return items
+
+    def _work(self):
+        while True:
+            items = self._take()
+            blocks = [item[3] for item in items]
+
+            try:
+                # State is applied in block order. Concurrent workers can't
+                # overwrite newer state since the upsert only lets newer blocks win.
+                self.sync.process_blocks(blocks)
+                self.sync.metrics.inc('ingest_processed', len(blocks))
+                self.sync.metrics.set('ingest_lag', round(timer() - min(item[2] for item in items), 3))
+
+                with self._lock:
+                    for block in blocks:
+                        self._recent[block.number] = True
+
+                    while len(self._recent) > RECENT_SIZE:
+                        self._recent.popitem(last=False)
+
+            except Exception as e:
+                logger.exception(f'Could not process blocks {[b.number for b in blocks]}: {e}')
+                self.sync.metrics.inc('ingest_failed', len(blocks))
+
+            finally:
+                with self._lock:
+                    for block in blocks:
+                        self._pending.discard(block.number)
+
+                for _ in items:
+                    self._queue.task_done()
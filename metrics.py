@@ -0,0 +1,43 @@
+import json
+import utils
+
+from threading import Lock
+
+
+class Metrics:
+    """ Thread-safe registry of named values for monitoring """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = dict()
+        self._providers = dict()
+
+    def register(self, name: str, provider):
+        """ Add a callable whose result is included in every snapshot """
+        with self._lock:
+            self._providers[name] = provider
+
+    def set(self, name: str, value):
+        with self._lock:
+            self._values[name] = value
+
+    def inc(self, name: str, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def get(self, name: str, default=None):
+        with self._lock:
+            return self._values.get(name, default)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = dict(self._values)
+            providers = dict(self._providers)
+
+        for name, provider in providers.items():
+            values[name] = provider()
+
+        return values
+
+    def dump(self, path: str):
+        utils.write_atomic(path, json.dumps(self.snapshot(), sort_keys=True, indent=4, default=str))
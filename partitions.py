@@ -0,0 +1,102 @@
+import sql
+
+from database import DB
+from loguru import logger
+from threading import Lock
+from timeit import default_timer as timer
+
+# Tables that grow with every block - partitioned by ranges of block numbers
+TABLES = ('blocks', 'transactions', 'rewards')
+
+# Tables that reference blocks by their number
+REFERENCING = ('addresses', 'address_transactions', 'contracts', 'state', 'state_history', 'balances')
+
+
+class Partitions:
+    """ Partitions of blocks, transactions and rewards - a partition per range of 'size' block numbers.
+    Block numbers are nanosecond timestamps, so a range is a period of time """
+
+    db = None
+
+    def __init__(self, database: DB, size: int):
+        self.db = database
+        self.size = size
+
+        self._lock = Lock()
+        # Ranges whose partitions are committed
+        self._created = set()
+
+    def ranges(self, numbers) -> set:
+        return {number // self.size for number in numbers}
+
+    def create(self, cur, ranges):
+        for index in sorted(ranges):
+            for table in TABLES:
+                cur.execute(sql.create_partition(table, index, self.size))
+
+    def ensure(self, numbers):
+        """ Create missing partitions for the block numbers - in an own transaction before rows are saved in them """
+
+        if not self.ranges(numbers) - self._created:
+            return
+
+        with self._lock:
+            missing = self.ranges(numbers) - self._created
+
+            if not missing:
+                return
+
+            with self.db.transaction() as cur:
+                self.create(cur, missing)
+
+            self._created.update(missing)
+
+        logger.debug(f'Partitions ready for block number ranges {sorted(missing)}')
+
+    def migrate(self):
+        """ Move blocks, transactions and rewards into partitioned tables - sync and API must not run meanwhile """
+
+        start_time = timer()
+
+        with self.db.transaction() as cur:
+            # References to the old blocks table go - names of constraints and indexes are taken over
+            for table in TABLES[1:] + REFERENCING:
+                cur.execute(sql.drop_blocks_reference(table))
+
+            cur.execute(sql.drop_blocks_indexes())
+
+            for table in TABLES:
+                cur.execute(sql.rename_unpartitioned(table))
+
+            cur.execute(sql.create_blocks(partitioned=True))
+            cur.execute(sql.create_transactions(partitioned=True))
+            cur.execute(sql.create_rewards(partitioned=True))
+
+            cur.execute(sql.select_block_ranges('blocks_unpartitioned'), {'s': self.size})
+            ranges = [row[0] for row in cur.fetchall()]
+            self.create(cur, ranges)
+
+            logger.info(f'Created partitions for {len(ranges)} block number ranges')
+
+            # Blocks first - transactions and rewards reference them
+            for table in TABLES:
+                table_time = timer()
+                cur.execute(sql.copy_unpartitioned(table))
+                logger.info(f'Copied {cur.rowcount} rows of {table} - {timer() - table_time:.3f} seconds')
+
+            for table in reversed(TABLES):
+                cur.execute(sql.drop_unpartitioned(table))
+
+            for table in REFERENCING:
+                cur.execute(sql.add_blocks_reference(table))
+
+            cur.execute(sql.create_blocks_chain_index(concurrently=False))
+            cur.execute(sql.create_blocks_hash_index(concurrently=False))
+            cur.execute(sql.create_transactions_hash_index())
+
+        self._created.update(ranges)
+
+        for table in TABLES:
+            self.db.execute(sql.analyze(table))
+
+        logger.info(f'Partitioned {", ".join(TABLES)} - {timer() - start_time:.3f} seconds')
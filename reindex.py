@@ -0,0 +1,145 @@
+import os
+import sql
+import fastjson
+
+from sync import Sync
+from block import Block
+from batch import Batch
+from pathlib import Path
+from loguru import logger
+from archive import BlockArchive, INDEX_FILE
+from collections import deque
+from multiprocessing import Pool
+from timeit import default_timer as timer
+
+# Seconds between progress reports
+REPORT_INTERVAL = 10
+
+# Blocks that are checked for state before derived tables are emptied
+SAMPLE_SIZE = 1000
+
+# Archives opened by a worker process
+_archives = dict()
+
+
+def _content(kind: str, location: str, item) -> dict:
+    if kind == 'db':
+        return fastjson.loads(item)
+
+    if kind == 'files':
+        with open(item, 'rb') as f:
+            return fastjson.loads(f.read())
+
+    if location not in _archives:
+        _archives[location] = BlockArchive(location)
+
+    return _archives[location].get(item)
+
+
+def _batch(kind: str, location: str, items: list) -> Batch:
+    # Runs in a worker process - parsing blocks and encoding rows is the expensive part
+    return Batch([Block(_content(kind, location, item)) for item in items])
+
+
+class Reindexer:
+    """ Replays stored blocks through the sync pipeline - blocks are parsed in worker processes and written in bulk """
+
+    sync = None
+
+    def __init__(self, sync: Sync, workers: int = None, batch_size: int = 500):
+        self.sync = sync
+
+        self._workers = workers or os.cpu_count()
+        self._batch_size = batch_size
+
+    def source(self, source: str) -> tuple:
+        """ Kind, location and items of 'archive', 'db', an archive directory or a directory with block files """
+
+        if source == 'db':
+            # Blocks as text - decoded in the worker processes
+            return 'db', None, (row[0] for row in self.sync.db.stream(sql.select_blocks_text(), {}))
+
+        if source == 'archive':
+            source = self.sync.cfg.get('archive_dir')
+
+        if Path(source, INDEX_FILE).is_file():
+            return 'archive', source, BlockArchive(source).numbers
+
+        files = sorted(Path(source).glob('*.json'), key=lambda p: int(p.stem))
+        return 'files', source, [str(path) for path in files]
+
+    def stateless(self, source: str) -> int:
+        """ Number of sampled blocks whose transaction has no state - such blocks can't rebuild the state """
+
+        kind, location, items = self.source(source)
+
+        if kind == 'db':
+            return len(self.sync.db.execute(sql.select_stateless_blocks(), {'l': SAMPLE_SIZE}))
+
+        # Spread over all blocks - older ones might be from before state was kept in blocks
+        step = max(len(items) // SAMPLE_SIZE, 1)
+        contents = (_content(kind, location, item) for item in items[::step])
+
+        return sum(1 for content in contents if content.get('processed') and 'state' not in content['processed'])
+
+    def rebuild(self):
+        """ Empty all tables that are derived from blocks and save the genesis state again """
+
+        logger.info('Removing all data derived from blocks')
+        self.sync.db.execute(sql.truncate_derived())
+
+        self.sync.process_genesis_block()
+
+    def run(self, source: str) -> int:
+        """ Replay all blocks of the source and return the number of blocks """
+
+        kind, location, items = self.source(source)
+
+        # Blocks of the 'blocks' table don't need to be saved again
+        save_blocks = kind != 'db'
+
+        start = timer()
+        reported = start
+        count = 0
+
+        def chunks():
+            chunk = list()
+            for item in items:
+                chunk.append(item)
+                if len(chunk) >= self._batch_size:
+                    yield chunk
+                    chunk = list()
+            if chunk:
+                yield chunk
+
+        def write(batch: Batch):
+            with self.sync.db.transaction() as cur:
+                self.sync.write_batch(cur, batch, save_blocks=save_blocks)
+
+        logger.info(f'Reindexing blocks from {location or kind} with {self._workers} processes')
+
+        with Pool(self._workers) as pool:
+            # Limited number of batches in flight so that memory stays bounded
+            pending = deque()
+
+            for chunk in chunks():
+                pending.append(pool.apply_async(_batch, (kind, location, chunk)))
+
+                while len(pending) > self._workers * 2 or (pending and pending[0].ready()):
+                    batch = pending.popleft().get()
+                    write(batch)
+                    count += len(batch)
+
+                if timer() - reported >= REPORT_INTERVAL:
+                    reported = timer()
+                    logger.info(f'Reindex progress --> {count} blocks - {count / (reported - start):.1f} blocks/sec')
+
+            while pending:
+                batch = pending.popleft().get()
+                write(batch)
+                count += len(batch)
+
+        elapsed = timer() - start
+        logger.info(f'Reindexed {count} blocks - {elapsed:.3f} seconds - {count / elapsed:.1f} blocks/sec')
+
+        return count
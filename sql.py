@@ -1,3 +1,7 @@
+# Partitioned tables keep the rows of a range of block numbers in own tables
+_PARTITION_BY_BLOCK_NUM = "PARTITION BY RANGE (block_num)"
+
+
 def create_addresses():
     return """
     CREATE TABLE IF NOT EXISTS addresses (
@@ -8,8 +12,23 @@ def create_addresses():
     """
 
 
-def create_rewards():
+# Transactions an address took part in - the primary key lists them newest first with a backward index scan
+def create_address_transactions():
     return """
+    CREATE TABLE IF NOT EXISTS address_transactions (
+      address text NOT NULL,
+      block_num BIGINT NOT NULL REFERENCES blocks (number),
+      tx_hash text NOT NULL,
+      role text NOT NULL,
+      contract text,
+      function text,
+      PRIMARY KEY (address, block_num, tx_hash, role)
+    )
+    """
+
+
+def create_rewards(partitioned: bool = False):
+    return f"""
     CREATE TABLE IF NOT EXISTS rewards (
       block_num BIGINT NOT NULL REFERENCES blocks (number),
       key text NOT NULL,
@@ -17,7 +36,7 @@ def create_rewards():
       reward jsonb NOT NULL,
       created TIMESTAMP NOT NULL,
       PRIMARY KEY (block_num, key)
-    )
+    ) {_PARTITION_BY_BLOCK_NUM if partitioned else ""}
     """
 
 
@@ -47,68 +66,307 @@ def create_state():
     """
 
 
-def create_transactions():
+# Every value a key had - the primary key finds the value at a block with a backward index scan
+def create_state_history():
     return """
-    CREATE TABLE IF NOT EXISTS transactions (
+    CREATE TABLE IF NOT EXISTS state_history (
+      key text NOT NULL,
       block_num BIGINT NOT NULL REFERENCES blocks (number),
-      hash text NOT NULL PRIMARY KEY,
-      transaction JSONB NOT NULL,
-      created TIMESTAMP NOT NULL
+      value jsonb NOT NULL,
+      PRIMARY KEY (key, block_num)
+    )
+    """
+
+
+def create_state_key_index():
+    # Prefix search on keys with LIKE 'key%' or ~>=~ and ~<~ independent of the DB collation
+    return """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS state_key_pattern_idx ON state (key text_pattern_ops)
+    """
+
+
+def select_invalid_indexes():
+    # Left behind by a CREATE INDEX CONCURRENTLY that failed
+    return """
+    SELECT c.relname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid IN ('state'::regclass, 'blocks'::regclass) AND NOT i.indisvalid
+    """
+
+
+def drop_index(name: str):
+    return f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'
+
+
+def create_balances():
+    return """
+    CREATE TABLE IF NOT EXISTS balances (
+      contract text NOT NULL,
+      address text NOT NULL,
+      amount NUMERIC NOT NULL,
+      block_num BIGINT NOT NULL REFERENCES blocks (number),
+      PRIMARY KEY (contract, address)
     )
     """
 
 
-def create_blocks():
+def create_balances_amount_index():
+    # Address as tie-breaker so that pages of holders can continue after a given holder
+    return """
+    CREATE INDEX IF NOT EXISTS balances_amount_idx ON balances (contract, amount DESC, address DESC)
+    """
+
+
+def create_balances_address_index():
     return """
+    CREATE INDEX IF NOT EXISTS balances_address_idx ON balances (address)
+    """
+
+
+# Primary keys of partitioned tables have to contain the block number
+def create_transactions(partitioned: bool = False):
+    if partitioned:
+        return f"""
+        CREATE TABLE IF NOT EXISTS transactions (
+          block_num BIGINT NOT NULL REFERENCES blocks (number),
+          hash text NOT NULL,
+          transaction JSONB NOT NULL,
+          created TIMESTAMP NOT NULL,
+          PRIMARY KEY (block_num, hash)
+        ) {_PARTITION_BY_BLOCK_NUM}
+        """
+    else:
+        return """
+        CREATE TABLE IF NOT EXISTS transactions (
+          block_num BIGINT NOT NULL REFERENCES blocks (number),
+          hash text NOT NULL PRIMARY KEY,
+          transaction JSONB NOT NULL,
+          created TIMESTAMP NOT NULL
+        )
+        """
+
+
+# Transactions by hash if it's not the primary key
+def create_transactions_hash_index():
+    return """
+    CREATE INDEX IF NOT EXISTS transactions_hash_idx ON transactions (hash)
+    """
+
+
+def create_blocks(partitioned: bool = False):
+    return f"""
     CREATE TABLE IF NOT EXISTS blocks (
       number BIGINT NOT NULL PRIMARY KEY,
       hash text NOT NULL,
       block JSONB NOT NULL,
-      created TIMESTAMP NOT NULL
-    )
+      created TIMESTAMP NOT NULL,
+      previous text
+    ) {"PARTITION BY RANGE (number)" if partitioned else ""}
     """
 
 
+# Range 'index' covers block numbers from index * size up to (index + 1) * size
+def create_partition(table: str, index: int, size: int):
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table}_p{index:d} PARTITION OF {table}
+    FOR VALUES FROM ({index * size:d}) TO ({(index + 1) * size:d})
+    """
+
+
+def select_partitioned():
+    return """
+    SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'blocks'::regclass)
+    """
+
+
+# Block number ranges of saved blocks
+def select_block_ranges(table: str = 'blocks'):
+    return f"SELECT DISTINCT number / %(s)s FROM {table} ORDER BY 1"
+
+
+# Unpartitioned tables are kept until their rows are copied
+def rename_unpartitioned(table: str):
+    return f"""
+    ALTER TABLE {table} RENAME TO {table}_unpartitioned;
+    ALTER INDEX {table}_pkey RENAME TO {table}_unpartitioned_pkey
+    """
+
+
+def drop_unpartitioned(table: str):
+    return f"DROP TABLE {table}_unpartitioned"
+
+
+def copy_unpartitioned(table: str):
+    return f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned"
+
+
+def analyze(table: str):
+    return f"ANALYZE {table}"
+
+
+def drop_blocks_indexes():
+    return "DROP INDEX IF EXISTS blocks_chain_idx, blocks_hash_idx"
+
+
+def drop_blocks_reference(table: str):
+    return f"ALTER TABLE IF EXISTS {table} DROP CONSTRAINT IF EXISTS {table}_block_num_fkey"
+
+
+def add_blocks_reference(table: str):
+    return f"ALTER TABLE IF EXISTS {table} ADD CONSTRAINT {table}_block_num_fkey FOREIGN KEY (block_num) REFERENCES blocks (number)"
+
+
+# Hash of the previous block - DBs from before it existed get it with 'cli.py fill-previous'
+def add_blocks_previous():
+    return "ALTER TABLE blocks ADD COLUMN IF NOT EXISTS previous text"
+
+
+# Indexes of partitioned tables can't be built concurrently
+def create_blocks_chain_index(concurrently: bool = True):
+    # Gaps in the chain are found with an index-only scan
+    return f"""
+    CREATE INDEX {"CONCURRENTLY" if concurrently else ""} IF NOT EXISTS blocks_chain_idx ON blocks (number) INCLUDE (hash, previous)
+    """
+
+
+def create_blocks_hash_index(concurrently: bool = True):
+    return f"""
+    CREATE INDEX {"CONCURRENTLY" if concurrently else ""} IF NOT EXISTS blocks_hash_idx ON blocks (hash)
+    """
+
+
+# Highest saved blocks below block number %(n)s - from the index only once 'previous' is filled
+def select_chain_window():
+    return """
+    SELECT number, hash, COALESCE(previous, (SELECT b.block->>'previous' FROM blocks b WHERE b.number = c.number))
+    FROM blocks c
+    WHERE number < %(n)s
+    ORDER BY number DESC
+    LIMIT %(l)s
+    """
+
+
+def update_blocks_previous():
+    return """
+    UPDATE blocks SET previous = block->>'previous'
+    WHERE number IN (SELECT number FROM blocks WHERE previous IS NULL LIMIT %(l)s)
+    """
+
+
+# Blocks whose previous block is not the next lower block in the table - blocks are missing below them.
+# Hashes that are not filled yet are read from the block.
+def select_gaps():
+    return """
+    SELECT number, previous, lower_number
+    FROM (
+      SELECT number, lower_number, lower_hash,
+        COALESCE(previous, (SELECT b.block->>'previous' FROM blocks b WHERE b.number = c.number)) AS previous
+      FROM (
+        SELECT number, hash, previous, lag(number) OVER w AS lower_number, lag(hash) OVER w AS lower_hash
+        FROM blocks
+        WINDOW w AS (ORDER BY number)
+      ) c
+    ) g
+    WHERE number > 0 AND previous IS DISTINCT FROM lower_hash
+    ORDER BY number DESC
+    """
+
+
+# Balance in a state value 's.value' - a number, a fixed point number or null
+_AMOUNT = r"""CROSS JOIN LATERAL (SELECT CASE jsonb_typeof(s.value)
+      WHEN 'number' THEN s.value #>> '{}'
+      WHEN 'object' THEN s.value ->> '__fixed__'
+      WHEN 'null' THEN '0' END AS amount) v"""
+
+_AMOUNT_IS_NUMBER = r"v.amount ~ '^-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?$'"
+
+# Keys starting with %(k)s - a range instead of LIKE so that prepared statements can use the index
+_KEY_PREFIX = "key ~>=~ %(k)s::text AND key ~<~ (%(k)s::text || chr(1114111))"
+
+# Ordered like the index so that pages can continue after key %(after)s
+_KEY_AFTER = "AND key ~>~ %(after)s::text"
+_KEY_ORDER = "ORDER BY key USING ~<~ LIMIT %(l)s"
+
+
 def select_db_size():
     return """
     SELECT pg_size_pretty(pg_database_size(%(n)s))
     """
 
 
-# TODO: Rework to use params like all other statements
-def select_holders(contract: str, addresses: bool = True, contracts: bool = True, limit: int = 0):
-    add_con = top = ''
+# Holders are filtered only if either addresses (%(a)s) or contracts (%(cs)s) are wanted.
+# With 'after' the holders following amount %(aa)s and address %(ad)s are returned.
+def select_holders(after: bool = False):
+    return rf"""
+    SELECT address, amount
+    FROM balances
+    WHERE contract = %(c)s AND amount != 0
+    AND (%(a)s::bool = %(cs)s::bool OR (address LIKE 'con\_%%') = %(cs)s::bool)
+    {"AND (amount, address) < (%(aa)s::numeric, %(ad)s::text)" if after else ""}
+    ORDER BY amount DESC, address DESC
+    LIMIT %(l)s
+    """
 
-    if addresses and not contracts:
-        add_con = "AND state.clean NOT LIKE 'con_%'"
-    if contracts and not addresses:
-        add_con = "AND state.clean LIKE 'con_%'"
 
-    if limit != 0:
-        top = f"LIMIT {limit}"
+def select_balance():
+    return "SELECT amount FROM balances WHERE contract = %(c)s AND address = %(a)s"
 
-    return f"SELECT state.clean, state.val " \
-           f"FROM (SELECT REPLACE(key, '{contract}.balances:', '') AS clean, " \
-           f"(CASE WHEN value ? '__fixed__' THEN (value->>'__fixed__')::jsonb ELSE value END) AS val " \
-           f"FROM state WHERE key LIKE '{contract}.balances:%') AS state " \
-           f"WHERE state.clean NOT LIKE '%:%' AND state.val::decimal != '0.0' {add_con} " \
-           f"ORDER BY state.val DESC " \
-           f"{top}"
+
+def select_balances():
+    return """
+    SELECT contract, amount
+    FROM balances
+    WHERE address = %(a)s AND amount != 0
+    ORDER BY contract
+    """
 
 
-# TODO: Rework to use params like all other statements
-def select_balance(address: str, contract: str = None):
-    return f"SELECT (CASE WHEN value ? '__fixed__' THEN (value->>'__fixed__')::jsonb ELSE value END) " \
-           f"FROM state WHERE key LIKE '{contract}.balances:{address}'"
+def select_balance_at():
+    return f"""
+    SELECT v.amount::numeric
+    FROM (
+      SELECT value FROM state_history
+      WHERE key = %(k)s AND block_num <= %(b)s
+      ORDER BY block_num DESC
+      LIMIT 1
+    ) s
+    {_AMOUNT}
+    WHERE {_AMOUNT_IS_NUMBER}
+    """
+
+
+# Contracts an address ever had a balance in - each with its balance after block %(b)s
+def select_balances_at():
+    return f"""
+    SELECT contract, amount
+    FROM (
+      SELECT b.contract, v.amount::numeric AS amount
+      FROM balances b
+      CROSS JOIN LATERAL (
+        SELECT h.value FROM state_history h
+        WHERE h.key = b.contract || '.balances:' || b.address AND h.block_num <= %(b)s
+        ORDER BY h.block_num DESC
+        LIMIT 1
+      ) s
+      {_AMOUNT}
+      WHERE b.address = %(a)s AND {_AMOUNT_IS_NUMBER}
+    ) a
+    WHERE amount != 0
+    ORDER BY contract
+    """
 
 
-# TODO: Rework to use params like all other statements
-def select_balances(address: str):
-    return f"SELECT substring(key from 0 for position('.' in key)), " \
-           f"(CASE WHEN value ? '__fixed__' THEN (value->>'__fixed__')::jsonb ELSE value END) " \
-           f"FROM state " \
-           f"WHERE key LIKE '%balances:{address}' AND (value->>'__fixed__')::decimal != 0" \
-           f"ORDER BY key"
+def select_missing_history():
+    return "SELECT EXISTS (SELECT 1 FROM state) AND NOT EXISTS (SELECT 1 FROM state_history)"
+
+
+def select_missing_address_transactions():
+    return "SELECT EXISTS (SELECT 1 FROM transactions) AND NOT EXISTS (SELECT 1 FROM address_transactions)"
+
+
+def select_any_balance():
+    return "SELECT EXISTS (SELECT 1 FROM balances)"
 
 
 def select_block_by_num():
@@ -119,8 +377,43 @@ def select_block_by_hash():
     return "SELECT * FROM blocks WHERE hash = %(bh)s"
 
 
-def select_address():
-    return "SELECT * FROM addresses WHERE address = %(a)s"
+def select_blocks_text():
+    return "SELECT block::text FROM blocks WHERE number > 0 ORDER BY number"
+
+
+# Blocks with a transaction but without its state - saved before state was kept in blocks
+def select_stateless_blocks():
+    return """
+    SELECT number FROM blocks
+    WHERE number > 0 AND block ? 'processed' AND NOT (block->'processed' ? 'state')
+    LIMIT %(l)s
+    """
+
+
+# Everything that gets derived from blocks - the genesis state needs to be saved again afterwards
+def truncate_derived():
+    return "TRUNCATE transactions, rewards, state, state_history, balances, addresses, address_transactions, contracts"
+
+
+# Newest transactions of address %(a)s first - with 'after' the ones following block %(ab)s, hash %(ah)s and role %(ar)s
+def select_address_transactions(after: bool = False):
+    return f"""
+    SELECT json_build_object(
+      'block_num', a.block_num,
+      'hash', a.tx_hash,
+      'role', a.role,
+      'contract', a.contract,
+      'function', a.function,
+      'transaction', t.transaction,
+      'created', t.created
+    )
+    FROM address_transactions a
+    LEFT JOIN transactions t ON t.block_num = a.block_num AND t.hash = a.tx_hash
+    WHERE a.address = %(a)s
+    {"AND (a.block_num, a.tx_hash, a.role) < (%(ab)s::bigint, %(ah)s::text, %(ar)s::text)" if after else ""}
+    ORDER BY a.block_num DESC, a.tx_hash DESC, a.role DESC
+    LIMIT %(l)s
+    """
 
 
 def select_contract():
@@ -143,14 +436,16 @@ def select_contracts():
     return """
     SELECT json_build_object(
       'name', c.name,
-      'tx_hash', c.tx_hash,
+      'block_num', c.block_num,
       'lst001', c.lst001,
       'lst002', c.lst002,
       'lst003', c.lst003,
       'code', c.code
     )
     FROM contracts c
-    WHERE name LIKE '%(n)s%'
+    WHERE (%(n)s::text IS NULL OR starts_with(name, %(n)s::text))
+    AND (lst001 OR NOT %(l1)s) AND (lst002 OR NOT %(l2)s) AND (lst003 OR NOT %(l3)s)
+    ORDER BY name
     """
 
 
@@ -168,7 +463,7 @@ def select_raw_state():
     """
 
 
-def select_raw_states(partial_key: str = None):
+def select_raw_states(after: bool = False):
     return f"""
     SELECT json_build_object(
       'block_num', s.block_num,
@@ -178,7 +473,19 @@ def select_raw_states(partial_key: str = None):
       'created', s.created
     )
     FROM state s
-    WHERE key LIKE '{partial_key}%'
+    WHERE {_KEY_PREFIX} {_KEY_AFTER if after else ""}
+    {_KEY_ORDER}
+    """
+
+
+# Value of key %(k)s after block %(b)s
+def select_state_at(clean: bool = False):
+    return f"""
+    SELECT {"(CASE WHEN value ? '__fixed__' THEN (value->>'__fixed__')::jsonb ELSE value END)" if clean else "value"}
+    FROM state_history
+    WHERE key = %(k)s AND block_num <= %(b)s
+    ORDER BY block_num DESC
+    LIMIT 1
     """
 
 
@@ -192,59 +499,203 @@ def select_state(clean: bool = False):
         return "SELECT value FROM state WHERE key = %(k)s"
 
 
-def select_states(partial_key: str = None, clean: bool = False):
+def select_states(clean: bool = False, after: bool = False):
     if clean:
         return f"""
         SELECT key, (CASE WHEN value ? '__fixed__' THEN (value->>'__fixed__')::jsonb ELSE value END)
-        FROM state WHERE key LIKE '{partial_key}%'
+        FROM state WHERE {_KEY_PREFIX} {_KEY_AFTER if after else ""}
+        {_KEY_ORDER}
         """
     else:
-        return f"SELECT key, value FROM state WHERE key LIKE {partial_key}%"
+        return f"SELECT key, value FROM state WHERE {_KEY_PREFIX} {_KEY_AFTER if after else ''} {_KEY_ORDER}"
 
 
-def insert_block():
+def insert_blocks():
     return """
-    INSERT INTO blocks(number, hash, block, created)
-    VALUES (%(n)s, %(h)s, %(b)s, %(cr)s)
-    ON CONFLICT (number) DO UPDATE SET hash = %(h)s, block = %(b)s, created = %(cr)s
+    INSERT INTO blocks(number, hash, block, created, previous)
+    VALUES %s
+    ON CONFLICT (number) DO UPDATE SET hash = EXCLUDED.hash, block = EXCLUDED.block, created = EXCLUDED.created, previous = EXCLUDED.previous
     """
 
 
-def insert_transaction():
-    return """
-    INSERT INTO transactions(block_num, hash, transaction, created)
-    VALUES (%(bn)s, %(h)s, %(t)s, %(cr)s)
-    ON CONFLICT (hash) DO UPDATE SET block_num = %(bn)s, transaction = %(t)s, created = %(cr)s
-    """
+def insert_transactions(partitioned: bool = False):
+    if partitioned:
+        return """
+        INSERT INTO transactions(block_num, hash, transaction, created)
+        VALUES %s
+        ON CONFLICT (block_num, hash) DO UPDATE SET transaction = EXCLUDED.transaction, created = EXCLUDED.created
+        """
+    else:
+        return """
+        INSERT INTO transactions(block_num, hash, transaction, created)
+        VALUES %s
+        ON CONFLICT (hash) DO UPDATE SET block_num = EXCLUDED.block_num, transaction = EXCLUDED.transaction, created = EXCLUDED.created
+        """
 
 
-def insert_contract():
+def insert_contracts():
     return """
     INSERT INTO contracts(block_num, name, code, lst001, lst002, lst003, created)
-    VALUES (%(bn)s, %(n)s, %(c)s, %(l1)s, %(l2)s, %(l3)s, %(cr)s)
-    ON CONFLICT (name) DO UPDATE SET block_num = %(bn)s, code = %(c)s, lst001 = %(l1)s, lst002 = %(l2)s, lst003 = %(l3)s, created = %(cr)s
+    VALUES %s
+    ON CONFLICT (name) DO UPDATE SET block_num = EXCLUDED.block_num, code = EXCLUDED.code, lst001 = EXCLUDED.lst001, lst002 = EXCLUDED.lst002, lst003 = EXCLUDED.lst003, created = EXCLUDED.created
     """
 
 
-def insert_address():
+def insert_addresses():
     return """
     INSERT INTO addresses(block_num, address, created)
-    VALUES (%(bn)s, %(a)s, %(cr)s)
-    ON CONFLICT (address) DO NOTHING
+    VALUES %s
+    ON CONFLICT (address) DO UPDATE SET block_num = EXCLUDED.block_num, created = EXCLUDED.created
+    WHERE addresses.block_num > EXCLUDED.block_num
+    """
+
+
+def insert_address_transactions():
+    return """
+    INSERT INTO address_transactions(address, block_num, tx_hash, role, contract, function)
+    VALUES %s
+    ON CONFLICT (address, block_num, tx_hash, role) DO NOTHING
     """
 
 
-def insert_reward():
+def insert_rewards():
     return """
     INSERT INTO rewards(block_num, key, value, reward, created)
-    VALUES (%(bn)s, %(k)s, %(v)s, %(r)s, %(cr)s)
-    ON CONFLICT (block_num, key) DO UPDATE SET value = %(v)s, reward = %(r)s, created = %(cr)s
+    VALUES %s
+    ON CONFLICT (block_num, key) DO UPDATE SET value = EXCLUDED.value, reward = EXCLUDED.reward, created = EXCLUDED.created
+    """
+
+
+def insert_states():
+    return """
+    INSERT INTO state(block_num, key, value, created, updated)
+    VALUES %s
+    ON CONFLICT (key) DO UPDATE SET block_num = EXCLUDED.block_num, value = EXCLUDED.value, updated = EXCLUDED.updated
+    WHERE state.block_num <= EXCLUDED.block_num
     """
 
 
-def insert_state():
+# Balances are derived from state keys like 'currency.balances:{address}'
+_BALANCES_FROM_STATE = rf"""
+    INSERT INTO balances(contract, address, amount, block_num)
+    SELECT split_part(s.key, '.', 1), substr(s.key, strpos(s.key, '.balances:') + 10), v.amount::numeric, s.block_num
+    FROM state s
+    {_AMOUNT}
+    WHERE s.key ~ '^[^.:]+\.balances:[^:]+$'
+    AND {_AMOUNT_IS_NUMBER}
+    """
+
+
+# Changes that are saved already stay as they are
+def insert_state_history():
+    return """
+    INSERT INTO state_history(key, block_num, value)
+    VALUES %s
+    ON CONFLICT (key, block_num) DO NOTHING
+    """
+
+
+# Ordered by key so that concurrent writers lock rows in the same order
+def insert_balances():
+    return _BALANCES_FROM_STATE + """
+    AND s.key = ANY(%(k)s)
+    ORDER BY s.key
+    ON CONFLICT (contract, address) DO UPDATE SET amount = EXCLUDED.amount, block_num = EXCLUDED.block_num
+    WHERE balances.block_num <= EXCLUDED.block_num
+    """
+
+
+def insert_all_balances():
+    return _BALANCES_FROM_STATE + """
+    ON CONFLICT (contract, address) DO UPDATE SET amount = EXCLUDED.amount, block_num = EXCLUDED.block_num
+    WHERE balances.block_num <= EXCLUDED.block_num
+    """
+
+
+def notify():
+    return "SELECT pg_notify(%(c)s, %(p)s)"
+
+
+def create_genesis_state():
+    return """
+    CREATE TEMP TABLE genesis_state (
+      seq BIGINT NOT NULL,
+      key text NOT NULL,
+      value jsonb NOT NULL
+    ) ON COMMIT DROP
+    """
+
+
+def copy_genesis_state():
+    return "COPY genesis_state (seq, key, value) FROM STDIN"
+
+
+def insert_genesis_state():
     return """
     INSERT INTO state(block_num, key, value, created, updated)
-    VALUES (%(bn)s, %(k)s, %(v)s, %(cr)s, %(up)s)
-    ON CONFLICT (key) DO UPDATE SET block_num = %(bn)s, value = %(v)s, updated = %(up)s
+    SELECT DISTINCT ON (key) 0, key, value, '-infinity', '-infinity'
+    FROM genesis_state
+    ORDER BY key, seq DESC
+    ON CONFLICT (key) DO UPDATE SET block_num = EXCLUDED.block_num, value = EXCLUDED.value, updated = EXCLUDED.updated
+    WHERE state.block_num <= EXCLUDED.block_num
+    """
+
+
+# History starting at the current state - for DBs synced before the history was saved
+def insert_state_history_from_state():
+    return """
+    INSERT INTO state_history(key, block_num, value)
+    SELECT key, block_num, value
+    FROM state
+    ON CONFLICT (key, block_num) DO NOTHING
+    """
+
+
+def insert_genesis_state_history():
+    return """
+    INSERT INTO state_history(key, block_num, value)
+    SELECT DISTINCT ON (key) key, 0, value
+    FROM genesis_state
+    ORDER BY key, seq DESC
+    ON CONFLICT (key, block_num) DO UPDATE SET value = EXCLUDED.value
+    """
+
+
+def create_genesis_contracts():
+    return """
+    CREATE TEMP TABLE genesis_contracts (LIKE contracts) ON COMMIT DROP
+    """
+
+
+def copy_genesis_contracts():
+    return "COPY genesis_contracts (block_num, name, code, lst001, lst002, lst003, created) FROM STDIN"
+
+
+def insert_genesis_contracts():
+    return """
+    INSERT INTO contracts(block_num, name, code, lst001, lst002, lst003, created)
+    SELECT block_num, name, code, lst001, lst002, lst003, created
+    FROM genesis_contracts
+    ON CONFLICT (name) DO UPDATE SET block_num = EXCLUDED.block_num, code = EXCLUDED.code, lst001 = EXCLUDED.lst001, lst002 = EXCLUDED.lst002, lst003 = EXCLUDED.lst003, created = EXCLUDED.created
+    WHERE contracts.block_num <= EXCLUDED.block_num
+    """
+
+
+def select_contract_codes():
+    return """
+    SELECT name, code
+    FROM contracts
+    WHERE name > %(n)s
+    ORDER BY name
+    LIMIT %(l)s
+    """
+
+
+def update_contract_standards():
+    return """
+    UPDATE contracts c
+    SET lst001 = v.lst001, lst002 = v.lst002, lst003 = v.lst003
+    FROM (VALUES %s) AS v(name, lst001, lst002, lst003)
+    WHERE c.name = v.name
+    AND (c.lst001, c.lst002, c.lst003) IS DISTINCT FROM (v.lst001, v.lst002, v.lst003)
     """
@@ -0,0 +1,73 @@
+import re
+import hashlib
+
+from threading import Lock
+from collections import OrderedDict
+
+# Code (without spaces) a contract needs to contain to follow a standard
+STANDARDS = {
+    'lst001': (
+        'balances=Hash(',
+        '@export\ndeftransfer(amount:float,to:str):',
+        '@export\ndefapprove(amount:float,to:str):',
+        '@export\ndeftransfer_from(amount:float,to:str,main_account:str):'
+    ),
+    'lst002': (
+        'metadata=Hash(',
+    ),
+    'lst003': (
+        'collection_name=Variable()',
+        'collection_owner=Variable()',
+        'collection_nfts=Hash(',
+        'collection_balances=Hash(',
+        'collection_balances_approvals=Hash(',
+        '@export\ndefmint_nft(name:str,description:str,ipfs_image_url:str,metadata:dict,amount:int):',
+        '@export\ndeftransfer(name:str,amount:int,to:str):',
+        '@export\ndefapprove(amount:int,name:str,to:str):',
+        '@export\ndeftransfer_from(name:str,amount:int,to:str,main_account:str):'
+    )
+}
+
+# Number of classified contracts to remember
+CACHE_SIZE = 1024
+
+
+def _compile(standards: dict):
+    # Longest first so that the longest signature at a position matches
+    signatures = sorted({s for sigs in standards.values() for s in sigs}, key=len, reverse=True)
+
+    # Matches don't overlap, so a found signature also counts as
+    # every signature it contains, e.g. 'balances=Hash(' in 'collection_balances=Hash('
+    contains = {a: frozenset(b for b in signatures if b in a) for a in signatures}
+
+    return re.compile('|'.join(re.escape(s) for s in signatures)), contains
+
+
+_pattern, _contains = _compile(STANDARDS)
+_cache = OrderedDict()
+_lock = Lock()
+
+
+def classify(code: str) -> frozenset:
+    """ Names of all standards the contract code follows """
+
+    digest = hashlib.sha256(code.encode('utf-8')).digest()
+
+    with _lock:
+        if digest in _cache:
+            _cache.move_to_end(digest)
+            return _cache[digest]
+
+    # Normalize once and find all signatures in one scan
+    found = set()
+    for match in set(_pattern.findall(code.replace(' ', ''))):
+        found.update(_contains[match])
+
+    result = frozenset(name for name, sigs in STANDARDS.items() if found.issuperset(sigs))
+
+    with _lock:
+        _cache[digest] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return result
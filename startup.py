@@ -3,16 +3,17 @@ import os
 import sql
 import time
 import sys
-import json
+import fastjson
+import signal
 import websocket
 import utils
 
 from block import Block
 from tgbot import TelegramBot
 from sync import Sync
+from ingest import BlockQueue
 from database import DB
 from config import Config
-from threading import Thread
 from loguru import logger
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -27,6 +28,7 @@ class Startup:
     wst = None
     tgb = None
     sync = None
+    queue = None
     scheduler = None
 
     def __init__(self, config: Config, database: DB, tgbot: TelegramBot, sync: Sync):
@@ -37,16 +39,57 @@ class Startup:
 
         self.__init_db()
         self.__init_sync()
+
+        # Exit gracefully on 'kill' so that the sync checkpoint gets flushed
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        self.queue = BlockQueue(self.cfg, self.sync)
+
         self.__init_websocket()
 
     def __init_db(self):
+        partitioned = self.sync.partitions is not None
+
         try:
-            self.db.execute(sql.create_blocks())
-            self.db.execute(sql.create_transactions())
+            self.db.execute(sql.create_blocks(partitioned))
+            self.db.execute(sql.add_blocks_previous())
+
+            # Existing tables are converted with 'cli.py partition-tables'
+            if self.db.execute(sql.select_partitioned())[0][0] != partitioned:
+                logger.error(f'Tables are {"not " if partitioned else ""}partitioned - check db_partition_size')
+                raise SystemExit
+
+            self.db.execute(sql.create_transactions(partitioned))
             self.db.execute(sql.create_state())
-            self.db.execute(sql.create_rewards())
+            self.db.execute(sql.create_state_history())
+            self.db.execute(sql.create_rewards(partitioned))
             self.db.execute(sql.create_contracts())
             self.db.execute(sql.create_addresses())
+            self.db.execute(sql.create_address_transactions())
+            self.db.execute(sql.create_balances())
+            self.db.execute(sql.create_balances_amount_index())
+            self.db.execute(sql.create_balances_address_index())
+
+            # Without locking writes - on a big DB run 'cli.py create-indexes' first
+            self.db.execute(sql.create_state_key_index())
+            self.db.execute(sql.create_blocks_chain_index(concurrently=not partitioned))
+            self.db.execute(sql.create_blocks_hash_index(concurrently=not partitioned))
+
+            if partitioned:
+                self.db.execute(sql.create_transactions_hash_index())
+
+            # DB was synced before the state history was saved. Saved blocks can't fill it - blocks stored
+            # before state was kept in them have none. Older values need the blocks from the network again.
+            if self.db.execute(sql.select_missing_history())[0][0]:
+                logger.warning("State history is empty - start it at the current state with 'cli.py seed-history'")
+
+            if self.db.execute(sql.select_missing_address_transactions())[0][0]:
+                logger.warning("Transactions of addresses are missing - fill them with 'cli.py reindex --source db'")
+
+            # DB was synced before balances were saved separately
+            if not self.db.execute(sql.select_any_balance())[0][0]:
+                logger.info('Filling balances from state...')
+                self.db.execute(sql.insert_all_balances())
         except Exception as e:
             logger.exception(e)
             raise SystemExit
@@ -63,8 +106,43 @@ class Startup:
             next_run_time=datetime.now() + timedelta(seconds=5),
             max_instances=1)
 
+        # Blocks missing between saved blocks, e.g. after blocks from the websocket got saved out of order
+        self.scheduler.add_job(
+            self.sync.backfill,
+            name="backfill_blocks",
+            trigger='interval',
+            seconds=self.cfg.get('job_interval_backfill') or 3600,
+            max_instances=1)
+
+        # Save sync progress even if no new blocks arrive
+        self.scheduler.add_job(
+            self.sync.checkpoint.flush,
+            name="flush_checkpoint",
+            trigger='interval',
+            seconds=self.cfg.get('checkpoint_interval') or 10,
+            max_instances=1)
+
+        if self.cfg.get('metrics_file'):
+            self.scheduler.add_job(
+                self.sync.metrics.dump,
+                args=[self.cfg.get('metrics_file')],
+                name="dump_metrics",
+                trigger='interval',
+                seconds=self.cfg.get('job_interval_metrics') or 60,
+                max_instances=1)
+
         self.scheduler.start()
 
+    def stop(self):
+        """ Stop fetching blocks, save sync progress and exit without waiting for running jobs """
+        logger.info('Stopping...')
+
+        self.sync.fetcher.stop()
+        self.sync.checkpoint.flush()
+        self.scheduler.shutdown(wait=False)
+
+        sys.exit(0)
+
     def __init_websocket(self):
         while True:
             try:
@@ -95,16 +173,16 @@ class Startup:
     def on_message(self, ws, msg):
         logger.info(f'New event --> {msg}')
 
-        raw = json.loads(msg)
+        raw = fastjson.loads(msg)
         event, data = raw['event'], raw['data']
 
         block = Block(data)
 
         if event == 'latest_block':
-            self.cfg.set('block_latest', block.number)
+            self.sync.checkpoint.set('block_latest', block.number)
         elif event == 'new_block':
-            self.cfg.set('block_latest', block.number)
-            Thread(target=self.sync.process_block, args=[block]).start()
+            self.sync.checkpoint.set('block_latest', block.number)
+            self.queue.put(block)
 
     def on_ping(self, ws, msg):
         logger.debug(f'Websocket got a PING')
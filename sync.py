@@ -1,19 +1,41 @@
+import re
 import sql
 import json
-import time
+import fastjson
+import utils
 import pytz
-
-import requests as r
+import standards
 
 from pathlib import Path
 from config import Config
 from database import DB
 from block import Block
+from batch import Batch
+from archive import BlockArchive
+from chain import ChainIndex
+from partitions import Partitions
+from cache import ALL
+from metrics import Metrics
+from checkpoint import Checkpoint
+from client import BlockClient
+from fetcher import Fetcher, Segment
 from loguru import logger
 from tgbot import TelegramBot
 from datetime import datetime
 from timeit import default_timer as timer
-from requests.exceptions import ConnectionError, HTTPError, Timeout, TooManyRedirects, RequestException
+from psycopg2.extras import execute_values
+
+# Rows per multi-row INSERT statement
+PAGE_SIZE = 1000
+
+# Notification payloads need to be shorter than this
+NOTIFY_SIZE = 8000
+
+# Previous hash of the first block of the chain
+NO_HASH = '0' * 64
+
+# State keys of token balances - same as in sql.insert_balances()
+BALANCE_KEY = re.compile(r'^([^.:]+)\.balances:([^:]+)$')
 
 
 # TODO: Do i really see errors if they happen?
@@ -22,12 +44,35 @@ class Sync:
     db = None
     cfg = None
     tgb = None
+    client = None
+    checkpoint = None
+    fetcher = None
+    metrics = None
+    archive = None
+    chain = None
+    partitions = None
 
     def __init__(self, config: Config, database: DB, tgbot: TelegramBot):
         self.cfg = config
         self.db = database
         self.tgb = tgbot
 
+        self.metrics = Metrics()
+        self.checkpoint = Checkpoint(self.cfg)
+        self.client = BlockClient(self.cfg)
+        self.metrics.register('hosts', self.client.stats)
+        self.fetcher = Fetcher(self.cfg, self.get_block, self.process_blocks, self.metrics)
+        self.chain = ChainIndex(self.db, self.cfg.get('sync_prefetch_size'))
+
+        if self.db.cfg.get('db_partition_size'):
+            self.partitions = Partitions(self.db, self.db.cfg.get('db_partition_size'))
+
+        if self.cfg.get('archive_blocks'):
+            self.archive = BlockArchive(
+                self.cfg.get('archive_dir'),
+                segment_size=self.cfg.get('archive_segment_size'),
+                level=self.cfg.get('archive_level'))
+
     def process_genesis_block(self):
         total_time = timer()
 
@@ -46,217 +91,238 @@ class Sync:
         # Set valid timestamp
         block_data['hlc_timestamp'] = '-infinity'
 
-        # Save block
-        start_time = timer()
-        self.insert_block(Block(block_data))
-        logger.debug(f'-> Saved genesis block - {timer() - start_time:.3f} seconds')
+        batch = Batch()
+        batch.add_block(Block(block_data))
 
-        # Check if state-change files exist
-        state_changes_list = Path(genesis_block_dir).glob('**/state_changes*.json')
-        genesis_state = list()
+        if self.partitions is not None:
+            self.partitions.ensure(batch.numbers)
 
-        # Merge state into one list
-        for path in state_changes_list:
-            with open(Path(path)) as f:
+        # Code and submission time of genesis contracts
+        codes, submitted = dict(), dict()
+
+        def state_rows():
+            seq = 0
+
+            # Parse state files incrementally instead of loading them completely
+            for path in sorted(Path(genesis_block_dir).glob('**/state_changes*.json')):
                 logger.debug(f'-> Adding genesis state changes from {path}')
-                genesis_state += json.load(f)
 
-        start_time = timer()
-        logger.debug(f'-> Saving genesis state...')
+                for kv in utils.iter_json_array(path):
+                    key = kv['key']
 
-        # Save genesis state in database
-        for kv in genesis_state:
-            self.db.execute(sql.insert_state(),
-                {'bn': 0, 'k': kv['key'], 'v': json.dumps(kv['value']), 'cr': '-infinity', 'up': '-infinity'})
+                    if key.endswith('.__code__'):
+                        codes[key[:-len('.__code__')]] = kv['value']
+                    elif key.endswith('.__submitted__'):
+                        submitted[key[:-len('.__submitted__')]] = kv['value']['__time__']
 
-        logger.debug(f'-> Saved genesis state - {timer() - start_time:.3f} seconds')
+                    seq += 1
+                    yield seq, key, fastjson.dumps(kv['value'])
 
-        state = dict()
+        def contract_rows():
+            for name, code in codes.items():
+                created = datetime(*submitted[name], tzinfo=pytz.UTC)
 
-        logger.debug(f'-> Transforming genesis state...')
+                found = standards.classify(code)
 
-        # Create proper dict from state
-        for entry in genesis_state:
-            state[entry['key']] = entry['value']
+                yield 0, name, code, 'lst001' in found, 'lst002' in found, 'lst003' in found, created
 
-        start_time = timer()
-        logger.debug(f'-> Saving genesis contracts...')
+        # Block, state and contracts are saved together or not at all
+        with self.db.transaction() as cur:
 
-        # Identify contracts
-        for key, value in state.items():
-            if key.endswith('.__code__'):
-                code = value
-                name = key[:key.index('.__code__')]
-                submitted = state[name + '.__submitted__']['__time__']
-                submitted = datetime(*submitted, tzinfo=pytz.UTC)
+            # Save block
+            start_time = timer()
+            self.insert_blocks(cur, batch)
+            logger.debug(f'-> Saved genesis block - {timer() - start_time:.3f} seconds')
 
-                lst001 = Block.con_is_lst001(code)
-                lst002 = Block.con_is_lst002(code)
-                lst003 = Block.con_is_lst003(code)
+            # Save genesis state
+            start_time = timer()
+            logger.debug(f'-> Saving genesis state...')
+
+            cur.execute(sql.create_genesis_state())
+            rows = self.db.copy(cur, sql.copy_genesis_state(), state_rows())
+            cur.execute(sql.insert_genesis_state())
+            cur.execute(sql.insert_genesis_state_history())
 
-                self.db.execute(sql.insert_contract(),
-                    {'bn': 0, 'n': name, 'c': code, 'l1': lst001, 'l2': lst002, 'l3': lst003, 'cr': submitted})
+            elapsed = timer() - start_time
+            logger.debug(f'-> Saved genesis state - {rows} rows - {elapsed:.3f} seconds - {rows / elapsed:.0f} rows/sec')
+
+            # Save genesis balances
+            start_time = timer()
+            cur.execute(sql.insert_all_balances())
+            logger.debug(f'-> Saved genesis balances - {cur.rowcount} rows - {timer() - start_time:.3f} seconds')
+
+            # Save genesis contracts
+            start_time = timer()
+            logger.debug(f'-> Saving genesis contracts...')
+
+            cur.execute(sql.create_genesis_contracts())
+            rows = self.db.copy(cur, sql.copy_genesis_contracts(), contract_rows())
+            cur.execute(sql.insert_genesis_contracts())
+
+            logger.debug(f'-> Saved genesis contracts - {rows} rows - {timer() - start_time:.3f} seconds')
+
+            self.notify(cur, [ALL])
 
-        logger.debug(f'-> Saved genesis contracts - {timer() - start_time:.3f} seconds')
         logger.debug(f'Finished processing genesis block - {timer() - total_time:.3f} seconds')
 
     def process_block(self, block: Block):
+        self.process_blocks([block])
+
+    def process_blocks(self, blocks: list):
         total_time = timer()
 
-        # SAVE BLOCK
-        start_time = timer()
-        self.insert_block(block)
-        logger.debug(f'-> Saved block {block.number} - {timer() - start_time:.3f} seconds')
+        # COLLECT ROWS
+        batch = Batch(blocks)
 
-        # SAVE TRANSACTION
-        start_time = timer()
-        self.insert_tx(block)
-        logger.debug(f'-> Saved tx {block.tx_hash} - {timer() - start_time:.3f} seconds')
+        if not batch:
+            return
 
-        # SAVE REWARDS
-        start_time = timer()
-        self.insert_rewards(block)
-        logger.debug(f'-> Saved rewards - {timer() - start_time:.3f} seconds')
+        # Everything is written in one transaction so that a block is never saved partially
+        with self.db.transaction() as cur:
+            self.write_batch(cur, batch)
 
-        # SAVE REWARDS STATE
-        start_time = timer()
-        self.insert_state(block, 'rewards')
-        logger.debug(f'-> Saved rewards state - {timer() - start_time:.3f} seconds')
+        if self.archive is not None:
 
-        # SAVE TAU BALANCE OF SENDER (TX FEE REDUCTION)
-        start_time = timer()
-        self.insert_sender_balance(block)
-        logger.debug(f'-> Saved sender balance - {timer() - start_time:.3f} seconds')
+            # ARCHIVE BLOCKS
+            start_time = timer()
+            added = self.archive.append(blocks)
+            logger.debug(f'-> Archived {added} blocks - {timer() - start_time:.3f} seconds')
 
-        if block.tx_is_valid:
+        logger.debug(f'Finished processing blocks {batch.numbers[0]} - {batch.numbers[-1]} '
+                     f'({len(batch)}) - {timer() - total_time:.3f} seconds')
 
-            # SAVE STATE
-            start_time = timer()
-            self.insert_state(block)
-            logger.debug(f'-> Saved state - {timer() - start_time:.3f} seconds')
+    def write_batch(self, cur, batch: Batch, save_blocks: bool = True):
+        # Partitions for new block number ranges are committed before rows get saved in them
+        if self.partitions is not None:
+            self.partitions.ensure(batch.numbers)
 
-            # SAVE ADDRESSES
+        # SAVE BLOCKS
+        if save_blocks:
             start_time = timer()
-            self.insert_address(block)
-            logger.debug(f'-> Saved addresses - {timer() - start_time:.3f} seconds')
+            self.insert_blocks(cur, batch)
+            logger.debug(f'-> Saved {len(batch.blocks)} blocks - {timer() - start_time:.3f} seconds')
+
+        # SAVE TRANSACTIONS
+        start_time = timer()
+        self.insert_txs(cur, batch)
+        logger.debug(f'-> Saved {len(batch.transactions)} tx - {timer() - start_time:.3f} seconds')
 
-            if block.is_new_contract:
+        # SAVE REWARDS
+        start_time = timer()
+        self.insert_rewards(cur, batch)
+        logger.debug(f'-> Saved {len(batch.rewards)} rewards - {timer() - start_time:.3f} seconds')
 
-                # SAVE CONTRACT
-                start_time = timer()
-                self.insert_contract(block)
-                logger.debug(f'-> Saved contract {block.contract} - {timer() - start_time:.3f} seconds')
+        # SAVE STATE (INCL. REWARDS STATE AND TAU BALANCE OF SENDER)
+        start_time = timer()
+        self.insert_state(cur, batch)
+        logger.debug(f'-> Saved {len(batch.state)} state - {timer() - start_time:.3f} seconds')
 
-        if self.cfg.get('save_blocks_to_file'):
+        # SAVE STATE HISTORY
+        start_time = timer()
+        self.insert_history(cur, batch)
+        logger.debug(f'-> Saved {len(batch.history)} state history - {timer() - start_time:.3f} seconds')
 
-            # SAVE BLOCK TO FILE
-            start_time = timer()
-            self.save_block_to_file(block)
-            logger.debug(f'-> Saved block {block.number} to file - {timer() - start_time:.3f} seconds')
+        # SAVE BALANCES
+        start_time = timer()
+        self.insert_balances(cur, batch)
+        logger.debug(f'-> Saved {cur.rowcount} balances - {timer() - start_time:.3f} seconds')
+
+        # SAVE ADDRESSES
+        start_time = timer()
+        self.insert_addresses(cur, batch)
+        logger.debug(f'-> Saved {len(batch.addresses)} addresses - {timer() - start_time:.3f} seconds')
+
+        # SAVE TRANSACTIONS OF ADDRESSES
+        start_time = timer()
+        self.insert_address_txs(cur, batch)
+        logger.debug(f'-> Saved {len(batch.address_txs)} address tx - {timer() - start_time:.3f} seconds')
 
-        logger.debug(f'Finished processing block {block.number} - {timer() - total_time:.3f} seconds')
+        # SAVE CONTRACTS
+        start_time = timer()
+        self.insert_contracts(cur, batch)
+        logger.debug(f'-> Saved {len(batch.contracts)} contracts - {timer() - start_time:.3f} seconds')
 
-    def insert_block(self, block: Block):
-        self.db.execute(sql.insert_block(),
-            {'n': block.number, 'h': block.hash, 'b': json.dumps(block.content), 'cr': block.timestamp})
+        # Cached API responses that depend on the changed data
+        self.notify(cur, self.changes(batch))
 
-    def insert_tx(self, block: Block):
-        self.db.execute(sql.insert_transaction(),
-            {'bn': block.number, 'h': block.tx_hash, 't': json.dumps(block.tx), 'cr': block.timestamp})
+    def changes(self, batch: Batch) -> list:
+        tags = {'blocks'}
 
-    def insert_rewards(self, block: Block):
-        for rw in block.rewards:
-            self.db.execute(sql.insert_reward(),
-                {'bn': block.number, 'k': rw['key'], 'v': json.dumps(rw['value']),
-                'r': json.dumps(rw['reward']), 'cr': block.timestamp})
+        for row in batch.state:
+            match = BALANCE_KEY.match(row[1])
+            if match:
+                tags.add(f'balances:{match.group(1)}')
+                tags.add(f'address:{match.group(2)}')
 
-            logger.trace(f'-> Reward {rw["key"]} saved')
+        tags.update(f'address:{row[0]}' for row in batch.address_txs)
 
-    def insert_sender_balance(self, block: Block):
-        for kv in block.state:
-            if kv['key'] == f'currency.balances:{block.sender}':
-                # Check if state is already known and newer than current data
-                data = self.db.execute(sql.select_raw_state(), {'k': kv['key']})
+        if batch.contracts:
+            tags.add('contracts')
+            tags.update(f'contract:{row[1]}' for row in batch.contracts)
 
-                if data and data[0] and data[0][0] and data[0][0]['block_num'] > block.number:
-                    logger.trace(f'-> State {kv["key"]} skipped - newer present')
-                    continue
+        return sorted(tags)
 
-                self.db.execute(sql.insert_state(),
-                    {'bn': block.number, 'k': kv['key'], 'v': json.dumps(kv['value']),
-                    'cr': block.timestamp, 'up': block.timestamp})
+    def notify(self, cur, tags: list):
+        """ Notify listeners about changed data - delivered only if the transaction commits """
 
-                logger.trace(f'-> State {kv["key"]} saved')
+        channel = self.cfg.get('notify_channel')
 
-    def insert_state(self, block: Block, state: str = 'state'):
-        if state.lower() == 'state':
-            data = block.state
-        elif state.lower() == 'rewards':
-            data = block.rewards
-        else:
-            data = dict()
+        if not channel:
+            return
 
-        for kv in data:
-            # Check if state is already known and newer than current data
-            data = self.db.execute(sql.select_raw_state(), {'k': kv['key']})
+        payload = json.dumps(tags)
+        if len(payload) >= NOTIFY_SIZE:
+            payload = json.dumps([ALL])
 
-            if data and data[0] and data[0][0] and data[0][0]['block_num'] > block.number:
-                logger.trace(f'-> State {kv["key"]} skipped - newer present')
-                continue
+        cur.execute(sql.notify(), {'c': channel, 'p': payload})
 
-            self.db.execute(sql.insert_state(),
-                {'bn': block.number, 'k': kv['key'], 'v': json.dumps(kv['value']),
-                'cr': block.timestamp, 'up': block.timestamp})
+    def insert_blocks(self, cur, batch: Batch):
+        execute_values(cur, sql.insert_blocks(), batch.blocks, page_size=PAGE_SIZE)
 
-            logger.trace(f'-> State {kv["key"]} saved')
+    def insert_txs(self, cur, batch: Batch):
+        query = sql.insert_transactions(partitioned=self.partitions is not None)
+        execute_values(cur, query, batch.transactions, page_size=PAGE_SIZE)
 
-    def insert_contract(self, block: Block):
-        self.db.execute(sql.insert_contract(),
-            {'bn': block.number, 'n': block.contract, 'c': block.code,
-            'l1': block.is_lst001, 'l2': block.is_lst002, 'l3': block.is_lst003, 'cr': block.timestamp})
+    def insert_rewards(self, cur, batch: Batch):
+        execute_values(cur, sql.insert_rewards(), batch.rewards, page_size=PAGE_SIZE)
 
-    def insert_address(self, block: Block):
-        for address in block.addresses:
-            # Check if address is already known and older than current data
-            data = self.db.execute(sql.select_address(), {'a': address})
+    def insert_state(self, cur, batch: Batch):
+        # Newer state wins - already stored keys of newer blocks are left untouched
+        execute_values(cur, sql.insert_states(), batch.state, page_size=PAGE_SIZE)
 
-            if data and data[0][0] < block.number:
-                logger.trace(f'Address {address} skipped - older present')
-                continue
+    def insert_history(self, cur, batch: Batch):
+        execute_values(cur, sql.insert_state_history(), batch.history, page_size=PAGE_SIZE)
 
-            self.db.execute(sql.insert_address(),
-                {'bn': block.number, 'a': address, 'cr': block.timestamp})
+    def insert_balances(self, cur, batch: Batch):
+        # Derived from the state that was just saved
+        cur.execute(sql.insert_balances(), {'k': [row[1] for row in batch.state]})
 
-            logger.trace(f'-> Address {address} saved')
+    def insert_contracts(self, cur, batch: Batch):
+        execute_values(cur, sql.insert_contracts(), batch.contracts, page_size=PAGE_SIZE)
 
-    def save_block_to_file(self, block: Block):
-        block_dir = self.cfg.get('block_dir')
-        Path(block_dir).mkdir(parents=True, exist_ok=True)
-        block_file = Path(block_dir, f'{block.number}.json')
+    def insert_addresses(self, cur, batch: Batch):
+        # Older address wins - first block an address was seen in is kept
+        execute_values(cur, sql.insert_addresses(), batch.addresses, page_size=PAGE_SIZE)
 
-        with open(block_file, 'w', encoding='utf-8') as f:
-            json.dump(block.content, f, sort_keys=True, indent=4)
+    def insert_address_txs(self, cur, batch: Batch):
+        execute_values(cur, sql.insert_address_transactions(), batch.address_txs, page_size=PAGE_SIZE)
 
-    # FIXME: Looks like the second sync that happens has wrong sync_start value and maybe also sync_end value
-    # After fully synced, sync_start should be None and thus
-    # TODO: Will probably need a `persist` argument that will need to be False for API executions and that
-    # will not save sync_start and sync_end
     def sync(self, start: int = None, end: int = None, check_db: bool = True):
         start_time = timer()
 
         logger.debug(f'Sync job --> Started...')
 
         # If not done yet, sync genesis block
-        if not self.cfg.get('genesis_processed'):
-            self.cfg.set('genesis_processed', True)
+        if not self.checkpoint.get('genesis_processed'):
+            self.checkpoint.set('genesis_processed', True, flush=True)
             self.process_genesis_block()
 
         # Block number to start syncing from
-        sync_start = start if start else self.cfg.get('sync_start')
-        if not sync_start: sync_start = self.cfg.get('block_latest')
+        sync_start = start if start else self.checkpoint.get('sync_start')
+        if not sync_start: sync_start = self.checkpoint.get('block_latest')
 
         # Block number to stop syncing at
-        sync_end = end if end else self.cfg.get('sync_end')
+        sync_end = end if end else self.checkpoint.get('sync_end')
         if not sync_end: sync_end = 0
 
         # End sync if both, start and end, are the same
@@ -269,8 +335,8 @@ class Sync:
             msg = f'Sync job --> sync_start {sync_start} < sync_end {sync_end}'
 
             # Set sync values to do a full resync
-            self.cfg.set('sync_start', None)
-            self.cfg.set('sync_end', 0)
+            self.checkpoint.set('sync_start', None)
+            self.checkpoint.set('sync_end', 0, flush=True)
 
             logger.warning(msg)
             self.tgb.send(msg)
@@ -278,78 +344,91 @@ class Sync:
 
         logger.debug(f'Sync from {sync_start} to {sync_end}')
 
-        block = self.get_block(sync_start, check_db=check_db)
+        def progress(segment: Segment, number: int):
+            # Everything down to this block is saved
+            self.checkpoint.set('sync_start', number)
+            logger.debug(f'Set sync_start to {number}')
 
-        while block:
-            # Process if data didn't come from DB
-            if not block.exists and not block.number == 0:
-                self.process_block(block)
+        finished = self.fetcher.run([Segment(sync_start, sync_end)], check_db=check_db, on_progress=progress)
 
-            # End sync if current block number is
-            # same as sync end or genesis block
-            if block.number in (sync_end, 0):
-                # New sync end is previous sync start
-                self.cfg.set('sync_end', sync_start)
-                logger.debug(f'Set sync_end to {sync_start}')
-                # New sync start will be block_latest
-                self.cfg.set('sync_start', None)
-                logger.debug(f'Set sync_start to {None}')
-                break
+        if finished:
+            # New sync end is previous sync start
+            self.checkpoint.set('sync_end', sync_start)
+            logger.debug(f'Set sync_end to {sync_start}')
+            # New sync start will be block_latest
+            self.checkpoint.set('sync_start', None, flush=True)
+            logger.debug(f'Set sync_start to {None}')
 
-            # Get previous block
-            block = self.get_block(block.prev, check_db=check_db)
+        logger.debug(f'Sync job --> Ended after {timer() - start_time:.3f} seconds')
 
-            # Set sync start to previous block number
-            if block:
-                self.cfg.set('sync_start', block.number)
-                logger.debug(f'Set sync_start to {block.number}')
+    def find_gaps(self) -> list:
+        """ Segments of the chain that are missing between saved blocks """
 
-        logger.debug(f'Sync job --> Ended after {timer() - start_time:.3f} seconds')
+        start_time = timer()
+
+        # Blocks above 'sync_end' are still to be retrieved by the sync job
+        sync_end = self.checkpoint.get('sync_end') or 0
+
+        # Walked from the hash the block above the gap points to down to the block below it.
+        # The first block of the chain has no previous block to retrieve.
+        gaps = [Segment(previous, lower or 0) for _, previous, lower in self.db.execute(sql.select_gaps())
+                if previous and previous != NO_HASH and (lower or 0) < sync_end]
+
+        self.metrics.set('sync_gaps', len(gaps))
+        logger.debug(f'Found {len(gaps)} gaps in saved blocks - {timer() - start_time:.3f} seconds')
 
-    def get_block(self, block_id: (int, str), check_db: bool = True) -> Block:
-        """ 'block' param can either be block hash or block number """
+        return gaps
+
+    def backfill(self) -> int:
+        """ Retrieve only the blocks missing between saved blocks and return the number of closed gaps """
+
+        start_time = timer()
+        gaps = self.find_gaps()
+
+        if not gaps:
+            return 0
+
+        logger.info(f'Backfill job --> Retrieving blocks of {len(gaps)} gaps')
+
+        # Walk ends at the saved block below the gap instead of retrieving it again
+        finished = self.fetcher.run(gaps)
+
+        logger.info(f'Backfill job --> Closed {len(finished)} of {len(gaps)} gaps - {timer() - start_time:.3f} seconds')
+        return len(finished)
+
+    def get_block(self, block_id: (int, str), check_db: bool = True, below: int = None) -> Block:
+        """ 'block' param can either be block hash or block number. 'below' is the number
+        of the block that points to it - the block is saved only if it's the highest saved block below """
+
+        if check_db and below is not None:
+            saved = self.chain.below(below)
+
+            if saved and saved[1] == block_id:
+                logger.debug(f'Block {block_id} already saved')
+
+                # Only what is needed to walk on - saved blocks are not written again
+                number, block_hash, previous = saved
+                return Block({'number': number, 'hash': block_hash, 'previous': previous, 'hlc_timestamp': ''}, exists=True)
 
         # Check if block is already in DB
-        if check_db:
+        elif check_db:
             if len(str(block_id)) == 64:
                 # 'block_id' is Block Hash
-                data = self.db.execute(sql.select_block_by_hash(), {'bh': block_id})
+                data = self.db.execute(sql.select_block_by_hash(), {'bh': block_id}, prepare=True)
             else:
                 # 'block_id' is Block Number
-                data = self.db.execute(sql.select_block_by_num(), {'bn': block_id})
+                data = self.db.execute(sql.select_block_by_num(), {'bn': block_id}, prepare=True)
 
             if data:
                 logger.debug(f'Retrieved block {block_id} from database')
                 return Block(data[0][2], exists=True)
 
         # Retrieve from web
-        for source in self.cfg.get('retrieve_from'):
-            host = source['host']
-            wait = source['wait']
-
-            host = host.replace('{block}', str(block_id))
-            logger.debug(f'Retrieving block {block_id} from {host}')
-
-            if wait:
-                logger.debug(f'Waiting for {wait} seconds...')
-                time.sleep(wait)
-
-            try:
-
-                # Get block from web
-                with r.get(host) as data:
-                    logger.info(f'Block {block_id} --> {data.text}')
-
-                    if 'error' in data.json():
-                        # Block Service does not know block
-                        logger.debug(f'Block {block_id} unknown - trying next host...')
-                        continue
-
-                    return Block(data.json())
+        logger.debug(f'Retrieving block {block_id}...')
+        content = self.client.get(block_id)
 
-            except (ConnectionError, HTTPError, Timeout, TooManyRedirects, RequestException) as e:
-                logger.error(f'Can not retrieve Block {block_id}: {repr(e)}')
-                self.tgb.send(f'‼️ Block Sync Error: {e}')
+        if content:
+            return Block(content)
 
         logger.error(f'Block {block_id} could not be retrieved! Tried all hosts.')
-        self.tgb.send(f'‼️ Block Sync Error: No host able to deliver block')
+        self.tgb.send(f'‼️ Block Sync Error: No host able to deliver block {block_id}')
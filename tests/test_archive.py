@@ -0,0 +1,65 @@
+from block import Block
+from archive import BlockArchive
+
+
+def block(number: int) -> Block:
+    return Block({
+        'number': str(number),
+        'hash': f'{number:064x}',
+        'previous': f'{number - 1:064x}',
+        'hlc_timestamp': '2022-04-15T05:20:04.280387012Z_0',
+        'processed': {'hash': f'{number:064x}', 'state': [{'key': f'key{number}', 'value': number}]}})
+
+
+def test_append_and_get(tmp_path):
+    archive = BlockArchive(tmp_path)
+    assert archive.append([block(n) for n in range(1, 5)]) == 4
+    # Archived blocks are skipped
+    assert archive.append([block(4)]) == 0
+    archive.close()
+
+    archive = BlockArchive(tmp_path)
+    assert archive.numbers == [1, 2, 3, 4]
+    assert archive.get(3) == block(3).content
+    assert archive.get(f'{2:064x}') == block(2).content
+    assert archive.get(5) is None
+    archive.close()
+
+
+def test_interrupted_append_is_cut_off(tmp_path):
+    archive = BlockArchive(tmp_path)
+    archive.append([block(n) for n in range(1, 5)])
+    archive.close()
+
+    # Written by an append that got interrupted before the index was
+    with open(tmp_path / '000000.zst', 'ab') as f:
+        f.write(b'leftover')
+    with open(tmp_path / 'index', 'ab') as f:
+        f.write(b'part')
+
+    archive = BlockArchive(tmp_path)
+    archive.append([block(n) for n in range(5, 9)])
+    archive.close()
+
+    archive = BlockArchive(tmp_path)
+    assert [archive.get(n) for n in range(1, 9)] == [block(n).content for n in range(1, 9)]
+    archive.close()
+
+
+def test_interrupted_append_after_roll_over(tmp_path):
+    # Every block gets its own segment
+    archive = BlockArchive(tmp_path, segment_size=1)
+    archive.append([block(n) for n in range(1, 5)])
+    archive.close()
+
+    # Segment that an interrupted append rolled over to - not in the index
+    with open(tmp_path / '000004.zst', 'wb') as f:
+        f.write(b'leftover')
+
+    archive = BlockArchive(tmp_path, segment_size=1)
+    archive.append([block(n) for n in range(5, 9)])
+    archive.close()
+
+    archive = BlockArchive(tmp_path, segment_size=1)
+    assert [archive.get(n) for n in range(1, 9)] == [block(n).content for n in range(1, 9)]
+    archive.close()
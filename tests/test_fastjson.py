@@ -0,0 +1,27 @@
+import json
+import pytest
+import fastjson
+
+from decimal import Decimal
+
+
+@pytest.fixture(params=[True, False], ids=['fragment', 'no fragment'])
+def fragment(request, monkeypatch):
+    # orjson before 3.9 has no Fragment
+    if not request.param:
+        monkeypatch.setattr(fastjson, '_fragment', None)
+    return request.param
+
+
+def test_raw_json_is_inserted(fragment, monkeypatch):
+    # Encoded by orjson - not by the standard library fallback
+    monkeypatch.setattr(fastjson, '_plain', lambda obj: pytest.fail('fell back to the standard library'))
+
+    data = [[fastjson.RawJSON('{"key": "a", "value": {"__fixed__": "1.5"}}')], {'amount': Decimal('2.50')}]
+
+    assert json.loads(fastjson.dumps(data)) == [[{'key': 'a', 'value': {'__fixed__': '1.5'}}], {'amount': 2.5}]
+
+
+def test_big_integers():
+    assert fastjson.loads(fastjson.dumps({'n': 2 ** 70})) == {'n': 2 ** 70}
+    assert json.loads(fastjson.dumps_bytes([fastjson.RawJSON('{"n": 1180591620717411303424}')])) == [{'n': 2 ** 70}]
@@ -0,0 +1,28 @@
+from metrics import Metrics
+from collections import namedtuple
+from fetcher import Fetcher, Segment
+
+FakeBlock = namedtuple('FakeBlock', ['number', 'prev', 'exists'])
+
+
+class Settings(dict):
+    """ Fetcher only reads settings with 'get' """
+
+
+def get_block(block_id, check_db=True, below=None):
+    return FakeBlock(block_id, block_id - 1, False)
+
+
+def test_stop_ends_walk():
+    written = list()
+    fetcher = None
+
+    def write(blocks):
+        written.extend(blocks)
+        fetcher.stop()
+
+    fetcher = Fetcher(Settings(fetch_workers=2, sync_batch_size=1), get_block, write, Metrics())
+
+    # Chain would be walked down to block 1 without the stop
+    assert fetcher.run([Segment(10 ** 9, 1)]) == []
+    assert len(written) == 1
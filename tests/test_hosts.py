@@ -0,0 +1,13 @@
+from hosts import HostSelector
+
+
+def test_latency_starts_at_first_sample():
+    selector = HostSelector({}, ['a', 'b'])
+
+    # Failed request measures no latency
+    selector.record('a', error=True)
+    selector.record('a', latency=2.0)
+    selector.record('b', latency=2.0)
+
+    stats = selector.stats()
+    assert stats['a']['latency'] == stats['b']['latency'] == 2.0
@@ -0,0 +1,49 @@
+import json
+import utils
+
+ITEMS = [123456789, 1.5e10, 'sss', [1, 2], None, True, {'key': 'con_a.b:c', 'value': {'__fixed__': '1.5'}}]
+
+
+def test_iter_json_array_small_chunks(tmp_path):
+    path = tmp_path / 'items.json'
+    path.write_text(json.dumps(ITEMS, indent=1), encoding='utf-8')
+
+    # Items split at every position between chunks
+    for chunk_size in range(1, 40):
+        assert list(utils.iter_json_array(str(path), chunk_size=chunk_size)) == ITEMS
+
+
+def test_iter_json_array_compact(tmp_path):
+    path = tmp_path / 'items.json'
+    path.write_text('[123456789,1.5e10,"sss",[1,2],null,true]', encoding='utf-8')
+
+    for chunk_size in (3, 4, 8):
+        assert list(utils.iter_json_array(str(path), chunk_size=chunk_size)) == ITEMS[:6]
+
+
+def test_write_atomic_concurrently(tmp_path):
+    from threading import Thread
+
+    path = str(tmp_path / 'checkpoint.json')
+    texts = [json.dumps({'writer': i, 'data': 'x' * 100000}) for i in range(8)]
+
+    errors = list()
+
+    def write(text):
+        try:
+            for _ in range(20):
+                utils.write_atomic(path, text)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=write, args=[text]) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Content of one of the writers and no temporary files left
+    assert not errors
+    with open(path, encoding='utf-8') as f:
+        assert f.read() in texts
+    assert [p.name for p in tmp_path.iterdir()] == ['checkpoint.json']
@@ -3,7 +3,7 @@ def create_kill_script(path: str):
     import os
 
     bang = '#!/bin/bash'
-    kill = f'kill -9 {os.getpid()}'
+    kill = f'kill {os.getpid()}'
 
     with open(path, 'w') as f:
         f.truncate(0)
@@ -14,6 +14,74 @@ def create_kill_script(path: str):
     os.chmod(path, mode)
 
 
+def write_atomic(path: str, data: str):
+    """ Replace file content so that readers never see a partially written file """
+    import os
+    import tempfile
+
+    # Own temporary file per write - other processes may write the same file at the same time
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f'{os.path.basename(path)}.')
+
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Temporary files are only readable by the owner
+        os.chmod(tmp_path, os.stat(path).st_mode if os.path.exists(path) else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def iter_json_array(path: str, chunk_size: int = 1024 * 1024):
+    """ Yield the items of a JSON array file one by one without loading the whole file """
+    import re
+    import json
+
+    decoder = json.JSONDecoder()
+    separator = re.compile(r'[\s,]*')
+    whitespace = re.compile(r'\s*')
+
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        pos = separator.match(buffer).end()
+
+        if not buffer.startswith('[', pos):
+            raise ValueError(f'No JSON array in {path}')
+
+        pos += 1
+        eof = False
+
+        while True:
+            pos = separator.match(buffer, pos).end()
+
+            if buffer.startswith(']', pos):
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # Item could continue in next chunk unless the next item or the end of the array follows
+                after = whitespace.match(buffer, end).end()
+                complete = eof or buffer.startswith((',', ']'), after)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+
+            if not complete:
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            yield item
+            pos = end
+
+
 # TODO: Still needed?
 def unwrap_fixed(value: str) -> str:
     if type(value) is dict and len(value) == 1 and '__fixed__' in value: